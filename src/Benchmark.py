@@ -0,0 +1,1045 @@
+#!/usr/bin/env python3.5
+
+# This Python script measures the rotary encoder and button code off the Pi on synthetic input.
+# It does not need any GPIO hardware. The decoder, replay, filter and gestures benchmarks also check their results
+# against the expected detents and actions, a regression stops them with an AssertionError. Run all benchmarks or only
+# the named ones:
+# python Benchmark.py
+# python Benchmark.py decoder
+
+import io
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from importlib import reload
+from threading import Event, Thread, Timer, active_count
+from time import perf_counter, process_time, thread_time, monotonic_ns, sleep
+from QuadratureDecoder import QuadratureDecoder, FULL_STEP, HALF_STEP, QUARTER_STEP
+from EdgeQueue import EdgeQueue
+from VolumeMixer import VolumeMixer
+from RotaryAcceleration import RotaryAcceleration
+from GpioBackend import GpioChipBackend, GpioMemBackend, packEvent, packLineRequest, LINE_REQUEST
+from GpioBackend import GPIO_V2_LINE_ATTR_ID_DEBOUNCE
+from GpioSimulator import SimulatedBackend, encoderTrace, buttonTrace, addBounce, addGlitches, saveTrace
+from GpioSimulator import createRegister, writeRegister
+from EdgeCapture import EdgeCapture
+from GpioSimulator import loadTrace
+from GlitchFilter import GlitchFilter
+from PowerAction import PowerAction
+from Metrics import Metrics
+from EventBus import EventBus
+from GpioDevices import Encoder, Button
+from TimerWheel import TimerWheel
+import RotaryEncoder
+import ShutdownRebootButton
+
+
+FORWARD = ((1, 0), (0, 0), (0, 1), (1, 1))     # channel states (A, B) of one -> cycle, starting from rest at 11
+
+
+# generate the channel states of a rotation, detents is positive for -> and negative for <-
+# every dropEvery-th state is left out to simulate edges that get lost on fast rotation (0 = no loss)
+def syntheticStates(detents, dropEvery=0):
+    cycle = FORWARD if detents > 0 else tuple(reversed(FORWARD[:3])) + ((1, 1),)
+    states = []
+    for i in range(abs(detents) * 4):
+        if dropEvery and i % dropEvery == dropEvery - 1 and i % 4 != 3:  # never drop the rest state, it completes the detent
+            continue
+        states.append(cycle[i % 4])
+    return states
+
+
+# the aDown/bUp/bDown flag machine of the original scripts, kept here for comparison
+def legacyDecode(states):
+    aDown = bUp = bDown = False
+    A = B = 1
+    value = 0
+    for newA, newB in states:
+        if newA != A:                   # rotaryInterruptA
+            A = newA
+            if aDown:
+                if not A:
+                    aDown = False
+            elif bUp or bDown:
+                pass
+            elif A:
+                if newB:
+                    aDown = True
+                    value += 1
+                else:
+                    bUp = True
+                    value -= 1
+        if newB != B:                   # rotaryInterruptB
+            B = newB
+            if B:
+                if bUp:
+                    bDown = True
+                    bUp = False
+            elif bDown:
+                bDown = False
+    return value
+
+
+# sustained decoding throughput and missed detents of QuadratureDecoder vs. the original flag machine
+def benchmarkDecoder(detents=100000):
+    print('decoder: %d detents per run' % detents)
+    for dropEvery in (0, 7, 3):
+        for direction in (1, -1):
+            states = syntheticStates(direction * detents, dropEvery)
+            expected = direction * detents
+            missedLegacy = abs(expected - legacyDecode(states))
+            for name, resolution in (('full', FULL_STEP), ('half', HALF_STEP), ('quarter', QUARTER_STEP)):
+                if resolution != FULL_STEP and dropEvery:
+                    continue                                    # the synthetic stream is a full step encoder
+                decoder = QuadratureDecoder(resolution)
+                update = decoder.update
+                start = perf_counter()
+                for A, B in states:
+                    update(A, B)
+                elapsed = perf_counter() - start
+                scale = FULL_STEP // resolution
+                missed = abs(expected * scale - decoder.position)
+                print('  %-7s %2s drop 1/%-3s %12.0f edges/s  missed %d  invalid %d  (legacy flags missed %d)'
+                      % (name, '->' if direction > 0 else '<-', dropEvery or '-', len(states) / elapsed,
+                         missed, decoder.invalid, missedLegacy))
+                assert missed == 0, 'decoder %s missed %d detents' % (name, missed)
+
+
+# latency percentiles in microseconds
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return tuple(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1e6 for q in (0.5, 0.99, 1.0))
+
+
+# fire callback(A, B, timestamp) for every state at the given edge rate, the edges of channel A and B come from two
+# threads like the interrupts of the two channels, the callbacks get the channel states at the time they run (like
+# GPIO.input() in an interrupt), returns the callback latencies and the CPU time spent in callbacks
+def replayBurst(callback, states, rate):
+    latencies = [[], []]
+    cpu = [0.0, 0.0]
+    current = [0]                           # index of the current channel states
+    start = perf_counter() + 0.01
+
+    def fire(channel):
+        for i in range(channel, len(states), 2):
+            delay = start + i / rate - perf_counter()
+            if delay > 0:                   # wait for the edge like an interrupt thread would, without burning CPU
+                sleep(delay)
+            if i > current[0]:              # the channels change, unless the other thread is already further
+                current[0] = i
+            cpuStart = thread_time()
+            callStart = perf_counter()
+            A, B = states[current[0]]
+            callback(A, B, monotonic_ns())
+            latencies[channel].append(perf_counter() - callStart)
+            cpu[channel] += thread_time() - cpuStart
+
+    threads = [Thread(target=fire, args=(channel,)) for channel in (0, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies[0] + latencies[1], cpu[0] + cpu[1]
+
+
+# CPU time and callback latency of the spin lock in the interrupts vs. the edge queue with one decoder thread
+def benchmarkQueue(rate=10000, detents=1000, workSeconds=0.0002):
+    print('queue: %d edges at %d edges/s, %.0f us blocking mixer access per detent' % (detents * 4, rate, workSeconds * 1e6))
+    states = syntheticStates(detents)
+
+    # the original scheme, decoding in the interrupts guarded by a busy-wait on a flag
+    decoder = QuadratureDecoder()
+    lock = [False]
+
+    def spinLockInterrupt(A, B, timestamp):
+        while lock[0]:
+            pass
+        lock[0] = True
+        if decoder.update(A, B):
+            sleep(workSeconds)    # stands in for the mixer round trips, which release the GIL
+        lock[0] = False
+
+    latencies, cpu = replayBurst(spinLockInterrupt, states, rate)
+    report('spin lock', latencies, cpu, decoder.position - detents, 0)
+
+    # the interrupts only enqueue, a single thread decodes
+    decoder = QuadratureDecoder()
+    edges = EdgeQueue(256)
+    consumerCpu = [0.0]
+
+    def decodeEdges(A, B, timestamp):
+        if decoder.update(A, B):
+            sleep(workSeconds)    # stands in for the mixer round trips, which release the GIL
+
+    def consumer():
+        cpuStart = thread_time()
+        edges.consume(decodeEdges)
+        consumerCpu[0] = thread_time() - cpuStart
+
+    thread = Thread(target=consumer)
+    thread.start()
+    latencies, cpu = replayBurst(lambda A, B, timestamp: edges.put((A, B, timestamp)), states, rate)
+    edges.close()
+    thread.join()
+    report('edge queue', latencies, cpu + consumerCpu[0], decoder.position - detents, edges.dropped)
+
+
+# print the results of a replayed burst
+def report(name, latencies, cpu, detentError, dropped):
+    p50, p99, pmax = percentiles(latencies)
+    print('  %-10s callback p50 %6.1f us  p99 %9.1f us  max %10.1f us  CPU %7.1f us/edge  detent error %d  dropped %d'
+          % (name, p50, p99, pmax, cpu / len(latencies) * 1e6, detentError, dropped))
+
+
+# stands in for alsaaudio.Mixer, every call takes latency seconds (like an ALSA round trip) and is counted
+class FakeMixer:
+    opened = 0                              # number of mixers opened, for all instances
+
+    def __init__(self, control='Master', latency=0.0001, volume=50):
+        FakeMixer.opened += 1
+        sleep(latency)
+        self.latency = latency
+        self.volume = volume
+        self.calls = 0
+        self._events = os.pipe()            # signals volume changes like the ALSA poll descriptors
+
+    def getvolume(self):
+        self.calls += 1
+        sleep(self.latency)
+        return [self.volume, self.volume]
+
+    def setvolume(self, volume):
+        self.calls += 1
+        sleep(self.latency)
+        self.volume = volume
+        os.write(self._events[1], b'\0')
+
+    def polldescriptors(self):
+        return [(self._events[0], select.POLLIN)]
+
+    def handleevents(self):
+        os.read(self._events[0], 4096)
+
+    def close(self):
+        os.close(self._events[0])
+        os.close(self._events[1])
+
+
+# per-detent latency and mixer calls of opening the mixer on every detent vs. the VolumeMixer
+def benchmarkMixer(detents=100, latency=0.0001):
+    print('mixer: %d detents, %.0f us per mixer call' % (detents, latency * 1e6))
+    for rate in (20, 200, 1000):
+        # the original scheme, open, read and write the mixer on every detent
+        FakeMixer.opened = 0
+        latencies = []
+        calls = 0
+        for i in range(detents):
+            start = perf_counter()
+            mixer = FakeMixer(latency=latency)
+            volume = int(mixer.getvolume()[0])
+            mixer.setvolume(min(100, max(0, volume + 1)))
+            latencies.append(perf_counter() - start)
+            calls += mixer.calls
+            mixer.close()
+            sleep(1 / rate)
+        p50, p99, pmax = percentiles(latencies)
+        print('  %5d detents/s  per detent     p50 %7.1f us  p99 %7.1f us  mixer calls %4d'
+              % (rate, p50, p99, calls + FakeMixer.opened))
+
+        # one mixer with a shadow volume and coalesced writes
+        FakeMixer.opened = 0
+        mixer = FakeMixer(latency=latency, volume=0)
+        volume = VolumeMixer(mixer=mixer)
+        latencies = []
+        for i in range(detents):
+            start = perf_counter()
+            volume.change(1)
+            latencies.append(perf_counter() - start)
+            sleep(1 / rate)
+        volume.close()
+        p50, p99, pmax = percentiles(latencies)
+        print('  %5d detents/s  VolumeMixer    p50 %7.1f us  p99 %7.1f us  mixer calls %4d  writes %d  volume %d'
+              % (rate, p50, p99, mixer.calls + FakeMixer.opened, volume.writes, mixer.volume))
+        mixer.close()
+
+
+# detents and mixer writes needed for a volume change at different rotation rates, with and without acceleration
+# the detents are at least 5 ms apart, so VolumeMixer writes the mixer once for every detent that changes the volume
+def benchmarkAcceleration(target=100):
+    print('acceleration: volume 0 -> %d' % target)
+    for rate in (2, 5, 10, 20, 40, 80):
+        for name, acceleration in (('fixed 1 %', None), ('accelerated', RotaryAcceleration())):
+            detents = writes = volume = largestStep = 0
+            timestamp = 0
+            while volume < target:
+                detents += 1
+                timestamp += 1000000000 // rate
+                steps = acceleration.scale(1, timestamp) if acceleration else 1
+                largestStep = max(largestStep, steps)
+                newVolume = min(100, volume + steps)
+                if newVolume != volume:
+                    writes += 1
+                    volume = newVolume
+            print('  %3d detents/s  %-11s  detents %3d  mixer writes %3d  largest step %2d %%'
+                  % (rate, name, detents, writes, largestStep))
+
+
+# a gpiochip backend that reads its events from a pipe instead of a GPIO line request
+class FakeChipBackend(GpioChipBackend):
+    def __init__(self):
+        GpioChipBackend.__init__(self, path=None)
+        self.wakeups = 0                    # number of event batches read
+
+    def _requestLines(self):
+        readFd, self.eventFd = os.pipe()
+        return readFd, {pin: 1 for pin, callback, debounce in self._watched}
+
+    def _readEvents(self):
+        self.wakeups += 1
+        GpioChipBackend._readEvents(self)
+
+
+# check the layout of the line request against the offsets in the kernel's struct gpio_v2_line_request, the fake
+# event fd bypasses the ioctl, so a layout bug would not show up otherwise
+def checkLineRequest():
+    assert LINE_REQUEST.size == 592, 'struct gpio_v2_line_request has 592 bytes, not %d' % LINE_REQUEST.size
+    request = packLineRequest([23, 24, 27], [0, 5000, 5000], 'check')
+    attrs = 64 * 4 + 32 + 8 + 4 + 5 * 4         # offsets, consumer, config.flags, config.num_attrs, config.padding
+    checks = (('config.flags', 64 * 4 + 32, '<Q', 0b100110100),    # BIAS_PULL_UP, EDGE_FALLING, EDGE_RISING, INPUT of linux/gpio.h
+              ('config.attrs[0].attr.id', attrs, '<I', GPIO_V2_LINE_ATTR_ID_DEBOUNCE),
+              ('config.attrs[0].attr.debounce_period_us', attrs + 8, '<I', 5000),
+              ('config.attrs[0].mask', attrs + 16, '<Q', 0b110),
+              ('config.attrs[1].attr.id', attrs + 24, '<I', 0),
+              ('num_lines', attrs + 10 * 24, '<I', 3))
+    for name, offset, form, expected in checks:
+        value = struct.unpack_from(form, request, offset)[0]
+        assert value == expected, '%s at offset %d is %d, not %d' % (name, offset, value, expected)
+    print('gpiochip: line request layout and flags checked, %d bytes, debounce attribute at offset %d'
+          % (LINE_REQUEST.size, attrs))
+
+
+# decoding throughput of the gpiochip event loop on a fake event fd, the events are written in batches like the kernel
+# queues them while the loop is busy
+def benchmarkGpiochip(detents=25000, batch=64):
+    checkLineRequest()
+    print('gpiochip: %d edges on a fake event fd, written in batches of up to %d' % (detents * 4, batch))
+    states = syntheticStates(detents)
+    decoder = QuadratureDecoder()
+    levels = [1, 1]
+    handled = [0]
+    gpio = FakeChipBackend()
+
+    def decodeEdges(pin, level, timestamp):
+        levels[pin] = level
+        decoder.update(levels[0], levels[1])
+        handled[0] += 1
+        if handled[0] == len(states):
+            gpio.stop()
+
+    gpio.watch(0, decodeEdges)
+    gpio.watch(1, decodeEdges)
+    gpio.start()
+    events = []
+    A, B = 1, 1
+    for newA, newB in states:
+        pin = 0 if newA != A else 1
+        events.append(packEvent(monotonic_ns(), pin, newA if pin == 0 else newB))
+        A, B = newA, newB
+
+    def write():
+        for i in range(0, len(events), batch):
+            os.write(gpio.eventFd, b''.join(events[i:i + batch]))
+
+    writer = Thread(target=write)
+    cpuStart = thread_time()
+    start = perf_counter()
+    writer.start()
+    gpio.run()
+    elapsed = perf_counter() - start
+    cpu = thread_time() - cpuStart
+    writer.join()
+    os.close(gpio.eventFd)
+    gpio.cleanup()
+    print('  %10.0f edges/s  %.1f edges per wakeup  CPU %.2f us/edge  detent error %d'
+          % (len(states) / elapsed, len(states) / gpio.wakeups, cpu / len(states) * 1e6, decoder.position - detents))
+
+
+# replace the glitch filter of a freshly loaded script: True keeps its default, None switches it off, a number is minPulse
+def setGlitchFilter(script, glitchFilter, timers=None):
+    if glitchFilter is not True:
+        script.glitchFilter = None if glitchFilter is None else GlitchFilter(glitchFilter, timers=timers)
+
+
+# replay a trace through RotaryEncoder.py, returns the backend, the CPU time and the terminal output of the script
+def replayEncoder(trace, speed, threaded, glitchFilter=True):
+    reload(RotaryEncoder)                   # start with fresh module state
+    setGlitchFilter(RotaryEncoder, glitchFilter)
+    gpio = SimulatedBackend(trace, speed=speed, threaded=threaded)
+    output = io.StringIO()
+    with redirect_stdout(output):           # catch the terminal output of the script
+        cpuStart = process_time()
+        RotaryEncoder.init(gpio)
+        gpio.run()
+        RotaryEncoder.edges.close()         # wait for the decoder thread, if any
+        if RotaryEncoder.glitchFilter:
+            RotaryEncoder.glitchFilter.close()  # pass on the last filtered edges
+        cpu = process_time() - cpuStart
+    return gpio, cpu, output.getvalue()
+
+
+# replay button presses through ShutdownRebootButton.py, returns the backend, the CPU time and the actions
+def replayButton(trace, glitchFilter=True):
+    reload(ShutdownRebootButton)
+    setGlitchFilter(ShutdownRebootButton, glitchFilter, ShutdownRebootButton.timers)
+    actions = []
+    power = ShutdownRebootButton.power
+    power.start = lambda command: actions.append('shutdown' if command == power.shutdownCommand else 'reboot')
+    gpio = SimulatedBackend(trace, timers=ShutdownRebootButton.timers)    # the gestures are timed in the time of the trace
+    cpuStart = process_time()
+    ShutdownRebootButton.init(gpio)
+    gpio.run()
+    if ShutdownRebootButton.glitchFilter:
+        ShutdownRebootButton.glitchFilter.close()
+    ShutdownRebootButton.timers.close()
+    return gpio, process_time() - cpuStart, actions
+
+
+# replay scripted edge traces at increasing edge rates through the encoder logic of RotaryEncoder.py and the button
+# logic of ShutdownRebootButton.py, with and without bounce and glitches
+def benchmarkReplay(detents=250):
+    print('replay: RotaryEncoder.py, %d detents -> then %d <- per trace' % (detents, detents))
+    for name, threaded in (('gpiochip-like', False), ('RPi.GPIO-like', True)):
+        for disturbance in ('clean', 'bounce', 'glitches'):
+            for rate in (1000, 5000, 20000, 50000):
+                trace = encoderTrace(detents, rate)
+                trace += encoderTrace(-detents, rate, start=trace[-1][0])
+                if disturbance == 'bounce':         # 30 % of the edges bounce twice within 2 us
+                    trace = addBounce(trace, pulses=2, width=500, probability=0.3)
+                elif disturbance == 'glitches':     # short pulses on both channels
+                    trace = addGlitches(trace, 23, detents // 10, width=300)
+                    trace = addGlitches(trace, 24, detents // 10, width=300, seed=1)
+                gpio, cpu, output = replayEncoder(trace, 1, threaded)
+                lines = output.split('\n')
+                forward = sum(1 for line in lines if line.startswith('->'))
+                backward = sum(1 for line in lines if line.startswith('<-'))
+                p50, p99, pmax = percentiles(gpio.latencies)
+                print('  %-13s %-8s %5d edges/s  -> %4d  <- %4d  missed %4d  invalid %4d  dropped %4d  '
+                      'callback p50 %5.1f us  p99 %6.1f us  max %8.1f us  CPU %5.1f us/edge'
+                      % (name, disturbance, rate, forward, backward, abs(detents - forward) + abs(detents - backward),
+                         RotaryEncoder.encoder.decoder.invalid, RotaryEncoder.edges.dropped, p50, p99, pmax,
+                         cpu / len(trace) * 1e6))
+                if rate <= 20000 and not RotaryEncoder.edges.dropped:   # at 50000 edges/s they are only minPulse apart
+                    assert (forward, backward) == (detents, detents), '%s %s %d edges/s: -> %d <- %d, not %d each' % (
+                        name, disturbance, rate, forward, backward, detents)
+
+    print('replay: ShutdownRebootButton.py')
+    for name, trace, expected in buttonTraces():
+        gpio, cpu, actions = replayButton(trace)
+        p50, p99, pmax = percentiles(gpio.latencies)
+        print('  %-14s  expected %-8s  got %-12s  callback p50 %5.1f us  max %6.1f us  CPU %5.1f us/edge'
+              % (name, ','.join(expected) or '-', formatActions(actions), p50, pmax, cpu / len(trace) * 1e6))
+        assert actions == expected, '%s: got %s, not %s' % (name, formatActions(actions), ','.join(expected) or '-')
+
+
+# overhead per edge of the edge capture, and the time to dump the ring buffer to a trace file
+def benchmarkCapture(edges=1000000, capacity=65536):
+    print('capture: %d edges into a ring buffer of %d' % (edges, capacity))
+    trace = encoderTrace(edges // 4, 10000)
+    callback = lambda pin, level, timestamp: None
+    for name, capture in (('no capture', None), ('capture', EdgeCapture(capacity))):
+        wrapped = capture.wrap(callback) if capture else callback
+        start = perf_counter()
+        for timestamp, pin, level in trace:
+            wrapped(pin, level, timestamp)
+        elapsed = perf_counter() - start
+        print('  %-10s  %.2f us per edge' % (name, elapsed / len(trace) * 1e6))
+
+    path = os.path.join(tempfile.mkdtemp(), 'edges.trace')
+    capture.dumpOnSignal(path)
+    start = perf_counter()
+    os.kill(os.getpid(), signal.SIGUSR1)    # the handler runs before kill() returns to the next bytecode
+    elapsed = perf_counter() - start
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    replayed = loadTrace(path)
+    print('  dump of %d edges on SIGUSR1: %.1f ms, %d bytes, last edges match: %s'
+          % (len(replayed), elapsed * 1e3, os.path.getsize(path), replayed == trace[-(capacity - 1):]))
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+# the disturbed button traces of the replay benchmark, as (name, trace, expected actions)
+def buttonTraces():
+    traces = []
+    for disturbance in ('clean', 'bounce', 'glitches'):
+        for pressSeconds, expected in ((0.5, []), (3, ['reboot']), (6, ['shutdown'])):
+            trace = buttonTrace(27, pressSeconds)
+            if disturbance == 'bounce':             # 5 bounces of 1 ms on press and release
+                trace = addBounce(trace, pulses=5, width=1000000)
+            elif disturbance == 'glitches':
+                trace = addGlitches(trace + [(trace[-1][0] + 1000000000, 27, 1)], 27, 10, width=10000)
+            traces.append(('%s %3.1f s' % (disturbance, pressSeconds), trace, expected))
+    return traces
+
+
+# the actions triggered by a replay, e.g. 'reboot x1'
+def formatActions(actions):
+    return ', '.join('%s x%d' % (action, actions.count(action)) for action in sorted(set(actions))) or '-'
+
+
+# analysis speed of TraceAnalyzer.py on a trace with millions of edges, and its recommended minPulse validated by replaying
+# disturbed traces through ShutdownRebootButton.py and RotaryEncoder.py without and with GlitchFilter
+def benchmarkFilter(detents=250000):
+    import TraceAnalyzer
+    trace = addBounce(encoderTrace(detents, 5000), pulses=2, width=500, probability=0.3)
+    capture = EdgeCapture(1 << (len(trace) - 1).bit_length())
+    for timestamp, pin, level in trace:
+        capture.record(pin, level, timestamp)
+    path = os.path.join(tempfile.mkdtemp(), 'edges.trace')
+    capture.dump(path)
+    start = perf_counter()
+    edges = TraceAnalyzer.loadTrace(path)
+    results = TraceAnalyzer.analyze(edges)
+    elapsed = perf_counter() - start
+    minPulse = TraceAnalyzer.recommendForPins(results)
+    print('filter: analysis of %d edges (%d bounce bursts) in %.2f s, %.1f M edges/s, recommended minPulse %s'
+          % (len(edges), sum(result['bursts'] for result in results.values()), elapsed, len(edges) / elapsed / 1e6,
+             TraceAnalyzer.formatTime(minPulse)))
+    start = perf_counter()
+    validation = TraceAnalyzer.validate(edges, minPulse)
+    elapsed = perf_counter() - start
+    print('  validation with GlitchFilter in %.2f s, %.2f us per edge: %s' % (elapsed, elapsed / len(edges) * 1e6, ', '.join(
+        'pin %d %d -> %d edges' % (pin, before, after) for pin, (before, after, shortest) in sorted(validation.items()))))
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+    traces = buttonTraces()
+    allEdges = TraceAnalyzer.traceArray([edge for name, trace, expected in traces for edge in trace])
+    minPulse = TraceAnalyzer.recommendForPins(TraceAnalyzer.analyze(allEdges))
+    print('filter: ShutdownRebootButton.py, recommended minPulse %s from all button traces'
+          % TraceAnalyzer.formatTime(minPulse))
+    for name, trace, expected in traces:
+        got = []
+        for glitchFilter in (None, minPulse / 1e9):
+            gpio, cpu, actions = replayButton(trace, glitchFilter)
+            got.append(formatActions(actions))
+        print('  %-14s  expected %-8s  unfiltered %-12s  filtered %s' % (name, ','.join(expected) or '-', *got))
+        assert got[1] == formatActions(expected), '%s filtered: got %s, not %s' % (name, got[1], formatActions(expected))
+
+    print('filter: RotaryEncoder.py, 250 detents -> then 250 <- per trace')
+    for disturbance in ('bounce', 'glitches'):
+        for rate in (1000, 5000, 20000):
+            trace = encoderTrace(250, rate)
+            trace += encoderTrace(-250, rate, start=trace[-1][0])
+            if disturbance == 'bounce':
+                trace = addBounce(trace, pulses=2, width=500, probability=0.3)
+            else:
+                trace = addGlitches(trace, 23, 25, width=300)
+                trace = addGlitches(trace, 24, 25, width=300, seed=1)
+            minPulse = TraceAnalyzer.recommendForPins(TraceAnalyzer.analyze(TraceAnalyzer.traceArray(trace)))
+            for glitchFilter in (None, minPulse / 1e9):
+                gpio, cpu, output = replayEncoder(trace, 0, False, glitchFilter)
+                lines = output.split('\n')
+                forward = sum(1 for line in lines if line.startswith('->'))
+                backward = sum(1 for line in lines if line.startswith('<-'))
+                decoded = RotaryEncoder.glitchFilter.passed if glitchFilter else gpio.delivered
+                print('  %-8s %5d edges/s  minPulse %-8s  -> %3d  <- %3d  edges decoded %4d of %4d  invalid %3d  CPU %4.1f us/edge'
+                      % (disturbance, rate, TraceAnalyzer.formatTime(minPulse) if glitchFilter else 'off', forward,
+                         backward, decoded, len(trace), RotaryEncoder.encoder.decoder.invalid, cpu / len(trace) * 1e6))
+                if glitchFilter:
+                    assert (forward, backward) == (250, 250), '%s %d edges/s filtered: -> %d <- %d, not 250 each' % (
+                        disturbance, rate, forward, backward)
+
+
+# the resident memory of this process in kB
+def residentMemory():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+# serve count devices (encoders and buttons by turns) with GpioDaemon.py on a simulated trace of them all being used at
+# the same time, this runs in a child process of benchmarkDaemon, so the memory of each run is measured separately
+def daemonChild(count, threaded, seconds=2.0):
+    import GpioDaemon
+    from GpioDevices import Encoder, Button, printDetents, printGesture
+    trace = []
+    devices = []
+    pin = 2
+    for i in range(count):
+        start = int(i * 1e7)                        # the devices start 10 ms apart
+        if i % 2 == 0:                              # an encoder turned -> and <- at 400 edges/s
+            devices.append((Encoder, ('encoder%d' % i, pin, pin + 1, printDetents), 0.00002))
+            detents = int(seconds * 400 / 8)
+            edges = encoderTrace(detents, 400, pin, pin + 1, start)
+            edges += encoderTrace(-detents, 400, pin, pin + 1, edges[-1][0])
+            trace += addBounce(edges, pulses=2, width=500, probability=0.3, seed=i)
+            pin += 2
+        else:                                       # a button pressed every 0.4 s for 0.2 s
+            devices.append((Button, ('button%d' % i, pin, GpioDaemon.timers, None, printGesture), 0.01))
+            for press in range(int(seconds / 0.4)):
+                trace += addBounce(buttonTrace(pin, 0.2, idle=0.2, start=start + int(press * 4e8)), pulses=3,
+                                   width=500000, seed=press)
+            pin += 1
+    trace.sort()
+    gpio = SimulatedBackend(trace, speed=1, threaded=threaded)
+    with redirect_stdout(io.StringIO()):            # catch the terminal output of the devices
+        rssStart = residentMemory()
+        for device, arguments, minPulse in devices:
+            GpioDaemon.addDevice(device(*arguments), minPulse)
+        GpioDaemon.init(gpio)
+        rssInit = residentMemory()
+        threads = active_count()
+        cpuStart = process_time()
+        gpio.run()
+        GpioDaemon.close()
+        cpu = process_time() - cpuStart
+    print(count, pin - 2, len(trace), rssInit, rssInit - rssStart, threads, cpu)
+
+
+# memory, threads and CPU of GpioDaemon.py serving 1 and 16 devices, each run in a fresh process, compared to one
+# script process per device
+def benchmarkDaemon():
+    print('daemon: GpioDaemon.py with 1 and 16 devices (encoders and buttons by turns) used at the same time for 2 s')
+    for name, threaded in (('gpiochip-like', False), ('RPi.GPIO-like', True)):
+        results = {}
+        for count in (1, 16):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'daemon-child', str(count),
+                                              str(int(threaded))], universal_newlines=True)
+            count, pins, edges, rss, rssDevices, threads, cpu = (float(field) for field in output.split())
+            results[count] = rss, threads, rssDevices
+            print('  %-13s %2d devices  %2d pins  %6d edges  RSS %6.1f MB (devices and threads %5.0f kB)  threads %d  '
+                  'CPU %5.1f us/edge' % (name, count, pins, edges, rss / 1024, rssDevices, threads, cpu / edges * 1e6))
+        rssPerDevice = (results[16][2] - results[1][2]) / 15
+        print('  %-13s per added device  RSS %5.1f kB, threads %.2f  (16 script processes: RSS %.1f MB, threads %d)'
+              % (name, rssPerDevice, (results[16][1] - results[1][1]) / 15, 16 * results[1][0] / 1024,
+                 16 * results[1][1]))
+
+
+# the gesture traces of the gestures benchmark, as (name, trace, expected actions), the button is on pin 27 and an
+# encoder on pins 23 and 24, each trace ends with an edge of the unused pin 0 after 6 s, so the last timers are due
+def gestureTraces():
+    doublePress = buttonTrace(27, 0.15)
+    doublePress += buttonTrace(27, 0.15, idle=0.2, start=doublePress[-1][0])
+    turn = buttonTrace(27, 1.0)
+    turn[1:1] = encoderTrace(3, 20, start=turn[0][0] + 200000000)
+    lostRelease = buttonTrace(27, 0.5)             # its release gets lost, see benchmarkGestures()
+    lostRelease += buttonTrace(27, 0.2, idle=3.0, start=lostRelease[-1][0])
+    traces = [('short press', buttonTrace(27, 0.2), 'press 0.2'),
+              ('double press', doublePress, 'double 0.15'),
+              ('hold 3 s', buttonTrace(27, 3.0), 'hold 3'),
+              ('hold 6 s', buttonTrace(27, 6.0), 'hold 5'),
+              ('press and turn', turn, 'turn 1, turn 1, turn 1'),
+              ('lost release', lostRelease, 'press 0.2')]
+    return [(name, trace + [(trace[-1][0] + 6000000000, 0, 1)], expected) for name, trace, expected in traces]
+
+
+# hold thresholds of count buttons pressed within 100 ms, timed by one TimerWheel or by a threading.Timer per press,
+# returns the latencies of the actions after their thresholds, the number of threads and the CPU time while waiting
+def holdLatencies(count, wheel, threshold=0.2):
+    latencies = []
+    done = Event()
+    timers = TimerWheel(0.01)
+    def held(deadline):
+        latencies.append((monotonic_ns() - deadline) / 1e9)
+        if len(latencies) == count:
+            done.set()
+    buttons = [Button('button%d' % i, i, timers, hold={threshold: lambda button, gesture, value: held(button.pressTime + int(threshold * 1e9))})
+               for i in range(count)]
+    if wheel:
+        timers.start()
+    threads = []
+    cpuStart = process_time()
+    for button in buttons:
+        if wheel:
+            button.edge(button.pin, 0, monotonic_ns())
+        else:                                       # a thread per press, as a straight forward implementation would do
+            pressTime = monotonic_ns()
+            threads.append(Timer(threshold, held, (pressTime + int(threshold * 1e9),)))
+            threads[-1].start()
+        sleep(0.1 / count)
+    threadCount = active_count()
+    done.wait(threshold + 2)
+    cpu = process_time() - cpuStart
+    timers.close()
+    return latencies, threadCount, cpu
+
+
+# button gestures of GpioDevices.Button on a TimerWheel: the gestures recognized on replayed traces in simulated time,
+# and in real time, how soon hold actions fire after their threshold with many buttons on one timer thread
+def benchmarkGestures():
+    print('gestures: GpioDevices.Button with hold {2 s, 5 s}, press, double and turn, replayed in simulated time')
+    for name, trace, expected in gestureTraces():
+        actions = []
+        record = lambda device, gesture, value: actions.append('%s %g' % (gesture, round(value, 2)))
+        timers = TimerWheel(0.01)
+        gpio = SimulatedBackend(trace, timers=timers)
+        button = Button('button', 27, timers, hold={2: record, 5: record}, press=record, double=record, turn=record,
+                        input=gpio.input)
+        encoder = Encoder('encoder', 23, 24, lambda encoder, steps: actions.append('detent %d' % steps))
+        encoder.modifier = button
+        callback = button.edge
+        if name == 'lost release':                  # the first release does not reach the button
+            releases = []
+            def callback(pin, level, timestamp):
+                if level and not releases:
+                    releases.append(timestamp)
+                else:
+                    button.edge(pin, level, timestamp)
+        gpio.watch(27, callback)
+        gpio.watch(23, encoder.edge)
+        gpio.watch(24, encoder.edge)
+        gpio.start()
+        gpio.run()
+        print('  %-14s  expected %-22s  got %s' % (name, expected, ', '.join(actions) or '-'))
+        assert ', '.join(actions) == expected, '%s: got %s, not %s' % (name, ', '.join(actions) or '-', expected)
+
+    print('gestures: hold threshold 0.2 s, buttons pressed within 100 ms, real time')
+    for count in (1, 64, 1024):
+        for name, wheel in (('TimerWheel', True), ('thread per press', False)):
+            latencies, threads, cpu = holdLatencies(count, wheel)
+            p50, p99, pmax = percentiles(latencies)
+            print('  %4d buttons  %-16s  fired %4d  latency p50 %5.1f ms  p99 %5.1f ms  max %5.1f ms  threads %4d  '
+                  'CPU %6.1f ms' % (count, name, len(latencies), p50 / 1000, p99 / 1000, pmax / 1000, threads, cpu * 1000))
+            assert len(latencies) == count, '%s fired %d of %d hold actions' % (name, len(latencies), count)
+
+
+# the time from the action to the exec of the command, through a shell as the scripts did before and with PowerAction,
+# and the time until power-off with pre-shutdown hooks run one after another or in parallel, all with stub commands
+def benchmarkPower(runs=20):
+    print('power: time to exec a stub reboot command, %d runs' % runs)
+    times = {'shell': [], 'PowerAction': []}
+    for run in range(runs):
+        start = perf_counter()
+        subprocess.call(['true &'], shell=True)     # as call(['sudo reboot &'], shell=True)
+        times['shell'].append(perf_counter() - start)
+        power = PowerAction(rebootCommand=('true',), log=lambda message: None)
+        power.execute(power.rebootCommand).wait()
+        times['PowerAction'].append(dict((name, seconds) for name, seconds, result in power.phases)['exec true'])
+    for name, latencies in times.items():
+        p50, p99, pmax = percentiles(latencies)
+        print('  %-12s  p50 %6.2f ms  max %6.2f ms' % (name, p50 / 1000, pmax / 1000))
+
+    hooks = [('sleep', '0.2'), ('sleep', '0.5'), ('sleep', '1'), ('sleep', '3')]     # the last one hangs
+    print('power: pre-shutdown hooks %s, hook timeout 1 s, deadline 2 s' % ', '.join(' '.join(hook) for hook in hooks))
+    start = perf_counter()
+    for hook in hooks:                              # one after another without timeout, as in rc.local
+        subprocess.call(hook)
+    subprocess.call(['true'])
+    print('  %-12s  until exec %6.0f ms' % ('serial', (perf_counter() - start) * 1000))
+    power = PowerAction(hookTimeout=1, deadline=2, rebootCommand=('true',), log=lambda message: None)
+    for hook in hooks:
+        power.addHook(hook)
+    power.execute(power.rebootCommand).wait()
+    print('  %-12s  until exec %6.0f ms  (%s)' % ('PowerAction', power.phases[-1][1] * 1000, ', '.join(
+        '%s %.0f ms %s' % (name, seconds * 1000, result) for name, seconds, result in power.phases[:-1])))
+
+
+# the cost per edge of the metrics on the hot path, switched off (no wrapper) and on, and a GpioDaemon.py replay with
+# the metrics exported to a text file and a Unix socket
+def benchmarkMetrics(edges=200000):
+    print('metrics: cost per edge of Encoder.edge, %d edges' % edges)
+    trace = encoderTrace(edges // 4, 10000)
+    results = {}
+    for name in ('off', 'on'):
+        encoder = Encoder('volume', 23, 24, lambda encoder, steps: None)
+        callback = encoder.edge if name == 'off' else Metrics().wrapEdges(encoder.edge)
+        now = monotonic_ns()
+        start = perf_counter()
+        for timestamp, pin, level in trace:
+            callback(pin, level, now)
+        results[name] = (perf_counter() - start) / len(trace)
+        print('  %-3s  %5.2f us/edge' % (name, results[name] * 1e6))
+    print('  overhead %.2f us/edge' % ((results['on'] - results['off']) * 1e6))
+
+    import GpioDaemon
+    from GpioDevices import printDetents, printGesture
+    directory = tempfile.mkdtemp()
+    GpioDaemon.metricsFile = os.path.join(directory, 'GpioDaemon.prom')
+    GpioDaemon.metricsSocket = os.path.join(directory, 'GpioDaemon.metrics')
+    GpioDaemon.addDevice(Encoder('volume', 23, 24, printDetents), 0.00002)
+    GpioDaemon.addDevice(Button('power', 27, GpioDaemon.timers, {2: printGesture}, printGesture), 0.01)
+    trace = addBounce(encoderTrace(400, 2000), pulses=2, width=500, probability=0.3)
+    for press, seconds in enumerate((0.2, 0.3, 2.5)):
+        trace += buttonTrace(27, seconds, idle=0.1, start=trace[-1][0])
+    gpio = SimulatedBackend(sorted(trace), speed=1, threaded=True)
+    with redirect_stdout(io.StringIO()):
+        GpioDaemon.init(gpio)
+        gpio.run()
+        sleep(0.1)                                  # let the decoder thread and the filters finish
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        start = perf_counter()
+        client.connect(GpioDaemon.metricsSocket)
+        text = b''.join(iter(lambda: client.recv(65536), b'')).decode()
+        fetch = perf_counter() - start
+        client.close()
+        GpioDaemon.close()
+    with open(GpioDaemon.metricsFile) as file:
+        lines = file.read().split('\n')
+    print('metrics: GpioDaemon.py replay of %d edges in real time, RPi.GPIO-like, %d bytes fetched from the socket in '
+          '%.2f ms, %d lines in %s' % (len(trace), len(text), fetch * 1000, len(lines), os.path.basename(GpioDaemon.metricsFile)))
+    for line in lines:
+        if line and not line.startswith('#') and '_bucket' not in line:
+            print('  ' + line)
+    os.remove(GpioDaemon.metricsFile)
+    os.rmdir(directory)
+
+
+# start GpioDaemon.py as systemd would, with the simulator backend replaying a detent 1 ms after edge detection is
+# armed, returns the times from the process start to READY=1 and to the first detent on stdout, and the watchdog pings
+def startupRun(directory, watchdog=0.2, seconds=1.0):
+    notifyPath = os.path.join(directory, 'notify')
+    tracePath = os.path.join(directory, 'startup.trace')
+    configPath = os.path.join(directory, 'startup.ini')
+    saveTrace([(0, 0, 0)] + encoderTrace(1, 1000) + [(int(seconds * 1e9), 0, 1)], tracePath)    # pin 0 is not watched
+    with open(configPath, 'w') as file:
+        file.write('[daemon]\nbackend = simulator\ntrace = %s\ncaptureSize = 0\n'
+                   '[volume]\ntype = encoder\npinA = 23\npinB = 24\naction = print\n' % tracePath)
+    notify = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    notify.bind(notifyPath)
+    environment = dict(os.environ, NOTIFY_SOCKET=notifyPath, WATCHDOG_USEC=str(int(watchdog * 1e6)),
+                       PYTHONUNBUFFERED='1')
+    environment.pop('WATCHDOG_PID', None)
+    start = perf_counter()
+    daemon = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GpioDaemon.py'),
+                               configPath], stdout=subprocess.PIPE, env=environment)
+    ready = detent = None
+    pings = 0
+    poller = select.poll()
+    poller.register(notify, select.POLLIN)
+    poller.register(daemon.stdout, select.POLLIN)
+    while True:
+        for fd, event in poller.poll(5000):
+            if fd == notify.fileno():
+                states = notify.recv(4096).decode().split('\n')
+                if 'READY=1' in states:
+                    ready = perf_counter() - start
+                pings += states.count('WATCHDOG=1')
+            elif daemon.stdout.readline():
+                if detent is None:
+                    detent = perf_counter() - start
+            else:
+                poller.unregister(daemon.stdout)
+        if daemon.poll() is not None:
+            break
+    while select.select([notify], [], [], 0)[0]:    # the last messages, e.g. STOPPING=1
+        pings += notify.recv(4096).decode().split('\n').count('WATCHDOG=1')
+    notify.close()
+    for path in (notifyPath, tracePath, configPath):
+        os.remove(path)
+    return ready, detent, pings
+
+
+# the time from the process start to systemd readiness and to the first handled detent of GpioDaemon.py, compared to
+# the start of a bare interpreter and the import of the daemon
+def benchmarkStartup(runs=5):
+    print('startup: GpioDaemon.py started as Type=notify service, simulator backend, %d runs, median' % runs)
+    median = lambda values: sorted(values)[len(values) // 2]
+    for name, code in (('interpreter', 'pass'), ('import GpioDaemon', 'import GpioDaemon')):
+        times = []
+        for run in range(runs):
+            start = perf_counter()
+            subprocess.check_call([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(perf_counter() - start)
+        print('  %-18s  %6.1f ms' % (name, median(times) * 1000))
+    directory = tempfile.mkdtemp()
+    results = [startupRun(directory) for run in range(runs)]
+    os.rmdir(directory)
+    print('  %-18s  %6.1f ms' % ('READY=1', median([ready for ready, detent, pings in results]) * 1000))
+    print('  %-18s  %6.1f ms  (its edges come 1 to 4 ms after READY=1)'
+          % ('first detent', median([detent for ready, detent, pings in results]) * 1000))
+    print('  %-18s  %6.1f per s  (WatchdogSec=0.2, pinged every 0.1 s from the main loop)'
+          % ('watchdog pings', median([pings for ready, detent, pings in results]) / 1.0))
+
+
+# count the events a subscriber receives and those dropped for it, until the bus closes the connection
+def readEvents(connection, received, lost, index, latencies=None):
+    rest = b''
+    while True:
+        data = connection.recv(65536)
+        if not data:
+            return
+        now = monotonic_ns()
+        lines = (rest + data).split(b'\n')
+        rest = lines.pop()
+        count = len(lines)
+        if latencies is not None or b'"dropped"' in data:   # decode them only if needed
+            for line in lines:
+                event = json.loads(line)
+                if event['event'] == 'dropped':
+                    lost[index] += event['count']
+                    count -= 1
+                elif latencies is not None:
+                    latencies.append((now - event['time']) / 1e9)
+        received[index] += count
+
+
+# publish events to subscribers connected to an EventBus, each read by a thread of its own, stuck subscribers connect
+# but never read, returns the bus, the events received and dropped per reading subscriber, the publish time per event
+# and the time until the reading subscribers got or lost all events
+def fanOut(path, subscribers, events, stuck=0, rate=0, latencies=None):
+    bus = EventBus(path)
+    bus.start()
+    connections = []
+    for i in range(subscribers + stuck):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+        connections.append(connection)
+    while len(bus.subscribers) < len(connections):
+        sleep(0.001)
+    received = [0] * subscribers
+    lost = [0] * subscribers
+    readers = [Thread(target=readEvents, args=(connections[i], received, lost, i, latencies)) for i in range(subscribers)]
+    for reader in readers:
+        reader.start()
+    event = {'time': 0, 'device': 'volume', 'event': 'detent', 'steps': 1, 'direction': 1, 'position': 0, 'rate': 4.2}
+    queued = bus._events
+    publishing = 0.0
+    start = perf_counter()
+    for i in range(events):
+        if rate:                                    # pace the events
+            delay = start + i / rate - perf_counter()
+            if delay > 0:
+                sleep(delay)
+        else:
+            while len(queued) > 512:                # as fast as the bus takes them out
+                sleep(0)
+        event = dict(event, time=monotonic_ns(), position=i)
+        publishStart = perf_counter()
+        bus.publish(event)
+        publishing += perf_counter() - publishStart
+    deadline = perf_counter() + 10
+    while min(map(sum, zip(received, lost))) < events and perf_counter() < deadline:
+        sleep(0.001)
+    elapsed = perf_counter() - start
+    bus.close()
+    for reader in readers:
+        reader.join()
+    for connection in connections:
+        connection.close()
+    return bus, received, lost, publishing / events, elapsed
+
+
+# events per second an EventBus delivers to 1 to 64 subscribers, the latency at encoder rates, and how much a stuck
+# subscriber that never reads costs the others
+def benchmarkEventbus(events=50000):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'events')
+    print('eventbus: %d detent events published as fast as the bus takes them, subscribers read in threads' % events)
+    for subscribers, stuck in ((1, 0), (16, 0), (64, 0), (16, 1)):
+        bus, received, lost, publish, elapsed = fanOut(path, subscribers, events, stuck)
+        print('  %2d subscribers%s  delivered %8.0f events/s  (%6.0f events/s each)  publish %4.2f us/event  '
+              'dropped %5.2f %%%s' % (subscribers, ' + 1 stuck' if stuck else '          ', sum(received) / elapsed,
+                                      events / elapsed, publish * 1e6, sum(lost) * 100 / (subscribers * events),
+                                      '  (stuck one: %d dropped)' % (bus.dropped - sum(lost)) if stuck else ''))
+    latencies = []
+    fanOut(path, 16, 2000, 1, rate=1000, latencies=latencies)
+    p50, p99, pmax = percentiles(latencies)
+    print('eventbus: 2000 events at 1000/s to 16 subscribers + 1 stuck, latency p50 %.0f us  p99 %.0f us  max %.0f us'
+          % (p50, p99, pmax))
+    os.rmdir(directory)
+
+
+# sample a fake level register with GpioMemBackend for seconds, returns the samples per second and the CPU time per
+# second and per sample
+def sampleRegister(path, rate, seconds=1.0):
+    gpio = GpioMemBackend(path, rate)
+    gpio.watch(23, lambda pin, level, timestamp: None)
+    gpio.start()
+    Timer(seconds, gpio.stop).start()
+    cpuStart = process_time()
+    start = perf_counter()
+    gpio.run()
+    elapsed = perf_counter() - start
+    cpu = process_time() - cpuStart
+    gpio.cleanup()
+    return gpio.samples / elapsed, cpu / elapsed, cpu / gpio.samples
+
+
+# decode an encoder turned -> and <- at rate edges per second, written into a fake register by a child process, while
+# GpioMemBackend samples it at sampleRate, returns the detents -> and <-, the invalid transitions and the samples
+def decodeRegister(path, detents, rate, sampleRate, snapshots):
+    createRegister(path)
+    gpio = GpioMemBackend(path, sampleRate)
+    turned = [0, 0]
+    def action(encoder, steps):
+        turned[steps < 0] += abs(steps)
+    encoder = Encoder('encoder', 23, 24, action, input=gpio.input if snapshots else None)
+    gpio.watch(23, encoder.edge)
+    gpio.watch(24, encoder.edge)
+    gpio.start()
+    writer = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'register-writer', path, str(detents),
+                               str(rate)])
+    def stop():
+        writer.wait()
+        sleep(0.02)                                 # the last samples
+        gpio.stop()
+    Thread(target=stop).start()
+    gpio.run()
+    gpio.cleanup()
+    return turned[0], turned[1], encoder.decoder.invalid, gpio.samples
+
+
+# the write side of decodeRegister(), in a child process, so it does not share the interpreter lock with the sampling
+def registerWriter(path, detents, rate):
+    trace = encoderTrace(detents, rate)
+    trace += encoderTrace(-detents, rate, start=trace[-1][0])
+    writeRegister(path, [(0, 0, 1)] + trace)        # the first edge, of the unused pin 0, starts the clock
+
+
+# the sample rate and CPU cost of the gpiomem backend on a fake register, and how well it decodes an encoder at
+# increasing edge rates, with both channels read from the same sample and with the levels of the edges only
+def benchmarkGpiomem(detents=200):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'gpiomem')
+    createRegister(path)
+    print('gpiomem: GpioMemBackend sampling a fake level register for 1 s')
+    for rate in (1000, 5000, 10000, 20000, 0):
+        samples, cpu, perSample = sampleRegister(path, rate)
+        print('  rate %-5s  %8.0f samples/s  CPU %5.1f %%  %5.2f us/sample'
+              % (rate or 'max', samples, cpu * 100, perSample * 1e6))
+    print('gpiomem: %d detents -> then %d <- written into the register by another process, sampled at 10 kHz' % (detents, detents))
+    for rate in (1000, 4000, 8000, 16000):
+        for name, snapshots in (('snapshots', True), ('edge levels', False)):
+            forward, backward, invalid, samples = decodeRegister(path, detents, rate, 10000, snapshots)
+            print('  %5d edges/s  %-11s  -> %3d  <- %3d  (expected %d each)  bridged %4d  samples %6d'
+                  % (rate, name, forward, backward, detents, invalid, samples))
+    os.remove(path)
+    os.rmdir(directory)
+
+
+BENCHMARKS = {
+    'decoder': benchmarkDecoder,
+    'queue': benchmarkQueue,
+    'mixer': benchmarkMixer,
+    'acceleration': benchmarkAcceleration,
+    'gpiochip': benchmarkGpiochip,
+    'replay': benchmarkReplay,
+    'capture': benchmarkCapture,
+    'filter': benchmarkFilter,
+    'daemon': benchmarkDaemon,
+    'gestures': benchmarkGestures,
+    'power': benchmarkPower,
+    'metrics': benchmarkMetrics,
+    'startup': benchmarkStartup,
+    'eventbus': benchmarkEventbus,
+    'gpiomem': benchmarkGpiomem}
+
+
+# the entry point
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['daemon-child']:
+        daemonChild(int(sys.argv[2]), bool(int(sys.argv[3])))
+        sys.exit()
+    if sys.argv[1:2] == ['register-writer']:
+        registerWriter(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+        sys.exit()
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.5
+
+# This Python module records the edges that the GPIO callbacks receive, so misbehaving units can be analyzed later.
+# The edges (timestamp in ns, pin, level) go into a ring buffer of preallocated arrays. Recording only writes three
+# array slots and an index, no lists or tuples grow, so it can stay switched on in production. The last capacity edges
+# are kept. On demand, e.g. with kill -USR1 PID, they are written oldest first to a binary trace file through mmap.
+# Recording goes on meanwhile, so a full buffer is written without its oldest edge, whose slot may be recorded again.
+# Trace file format (little endian): a 16 byte header (magic b'GPIOTRC1', uint32 number of edges, uint32 record size)
+# followed by one 12 byte record per edge (uint64 timestamp, uint16 pin, uint8 level, 1 byte padding).
+# The trace can be replayed with GpioSimulator.loadTrace() and SimulatedBackend, or loaded as a NumPy structured array
+# with loadTraceArray() (requires NumPy: sudo apt-get install python3-numpy).
+# Usage:
+# capture = EdgeCapture(65536)
+# gpio.watch(pin, capture.wrap(callback))   # record every edge before it is passed on to callback
+# capture.dumpOnSignal('/tmp/edges.trace')  # kill -USR1 PID writes the trace file
+
+import mmap
+import os
+import signal
+import struct
+from array import array
+
+
+TRACE_MAGIC = b'GPIOTRC1'
+TRACE_HEADER = struct.Struct('<8sII')       # magic, number of edges, record size
+TRACE_RECORD = struct.Struct('<QHBx')       # timestamp in ns, pin, level
+
+
+class EdgeCapture:
+    __slots__ = ('capacity', 'count', '_mask', '_next', '_times', '_pins', '_levels')
+
+    def __init__(self, capacity=65536):
+        if capacity & (capacity - 1):
+            raise ValueError('capacity must be a power of 2')
+        self.capacity = capacity                        # number of edges kept
+        self.count = 0                                  # number of edges recorded so far
+        self._mask = capacity - 1
+        self._next = 0                                  # the slot for the next edge
+        self._times = array('Q', bytes(8 * capacity))   # the ring buffer, one array per field
+        self._pins = array('H', bytes(2 * capacity))
+        self._levels = bytearray(capacity)
+
+    # record an edge, this is called in the GPIO callback
+    def record(self, pin, level, timestamp):
+        i = self._next
+        self._times[i] = timestamp
+        self._pins[i] = pin
+        self._levels[i] = level
+        self._next = (i + 1) & self._mask
+        self.count += 1
+
+    # return a callback that records the edge and then calls callback
+    def wrap(self, callback):
+        record = self.record
+
+        def recordingCallback(pin, level, timestamp):
+            record(pin, level, timestamp)
+            callback(pin, level, timestamp)
+        return recordingCallback
+
+    # write the recorded edges, oldest first, to a trace file, returns the number of edges written
+    def dump(self, path):
+        recorded = self.count                           # the callbacks may go on recording, so count first, record()
+        end = recorded & self._mask                     # increments it last, and the slots follow from it
+        times, pins, levels = self._times[:], self._pins[:], self._levels[:]
+        overwritten = self.count - recorded + 1         # slots recorded again while copying, and the slot at end, which
+        count = min(recorded, self.capacity - overwritten)  # a record() in progress may have written already
+        start = (end - count) & self._mask             # slot of the oldest edge
+
+        size = TRACE_HEADER.size + count * TRACE_RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            with mmap.mmap(fd, size) as trace:
+                TRACE_HEADER.pack_into(trace, 0, TRACE_MAGIC, count, TRACE_RECORD.size)
+                pack = TRACE_RECORD.pack_into
+                offset = TRACE_HEADER.size
+                for k in range(start, start + count):
+                    i = k & self._mask
+                    pack(trace, offset, times[i], pins[i], levels[i])
+                    offset += TRACE_RECORD.size
+        finally:
+            os.close(fd)
+        return count
+
+    # write the trace file whenever the process gets the signal, call this from the main thread
+    def dumpOnSignal(self, path, signum=signal.SIGUSR1):
+        signal.signal(signum, lambda signum, frame: self.dump(path))
+
+
+# check whether a file is a binary trace file
+def isTraceFile(path):
+    with open(path, 'rb') as file:
+        return file.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+# read a binary trace file as a list of edges (timestamp, pin, level)
+def readTrace(path):
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as trace:
+        magic, count, recordSize = TRACE_HEADER.unpack_from(trace)
+        if magic != TRACE_MAGIC or recordSize != TRACE_RECORD.size:
+            raise ValueError('%s is not a trace file' % path)
+        return list(TRACE_RECORD.iter_unpack(trace[TRACE_HEADER.size:TRACE_HEADER.size + count * recordSize]))
+
+
+# read a binary trace file as a NumPy structured array with the fields timestamp, pin and level
+def loadTraceArray(path):
+    import numpy
+    dtype = numpy.dtype({'names': ['timestamp', 'pin', 'level'], 'formats': ['<u8', '<u2', 'u1'],
+                         'offsets': [0, 8, 10], 'itemsize': TRACE_RECORD.size})
+    with open(path, 'rb') as file:
+        magic, count, recordSize = TRACE_HEADER.unpack(file.read(TRACE_HEADER.size))
+    if magic != TRACE_MAGIC or recordSize != TRACE_RECORD.size:
+        raise ValueError('%s is not a trace file' % path)
+    return numpy.fromfile(path, dtype=dtype, count=count, offset=TRACE_HEADER.size)
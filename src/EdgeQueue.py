@@ -0,0 +1,96 @@
+#!/usr/bin/env python3.5
+
+# This Python module hands edges over from the GPIO callbacks to a single decoder thread.
+# The callbacks only read the pins, take a timestamp and put() the result into the queue. This does not take any lock
+# (deque.append() is atomic), so the callbacks never wait for each other. The decoder thread takes the edges out in the
+# order they came in and sleeps while the queue is empty. The queue is bounded; when the decoder falls behind, the
+# oldest edges are pushed out and counted in dropped.
+# Glitch filters that the edges pass in the decoder thread are flushed by that thread, too, see addFilter(). A pending
+# level is passed on only when the queue is empty: while edges are queued, one of them may still reverse it.
+# Usage:
+# edges = EdgeQueue(256)
+# edges.start(decodeEdges)              # decodeEdges(*edge) is called in the decoder thread for every edge
+# edges.put((pin, level, timestamp))    # in the GPIO callback
+# edges.addFilter(glitchFilter)         # if decodeEdges is wrapped by a GlitchFilter
+# edges.close()                         # let the decoder thread finish the queued edges
+
+from collections import deque
+from threading import Event, Thread
+from time import monotonic_ns
+
+
+class EdgeQueue:
+    __slots__ = ('maxlen', 'dropped', 'closed', '_edges', '_wakeup', '_thread', '_filters')
+
+    def __init__(self, maxlen=256):
+        self.maxlen = maxlen                    # maximum number of edges waiting for the decoder
+        self.dropped = 0                        # number of edges pushed out because the queue was full
+        self.closed = False                     # set True to let the decoder thread finish
+        self._edges = deque(maxlen=maxlen)      # the edges waiting for the decoder, oldest first
+        self._wakeup = Event()                  # wakes the decoder thread when edges come in
+        self._thread = None                     # the decoder thread, if started with start()
+        self._filters = []                      # the GlitchFilters flushed by the decoder thread
+
+    # enqueue an edge, this is called in the GPIO callback and never blocks
+    def put(self, edge):
+        if len(self._edges) == self.maxlen:     # the queue is full
+            self.dropped += 1                   # the oldest edge will be pushed out
+        self._edges.append(edge)
+        if not self._wakeup.is_set():           # wake the decoder thread only if it is sleeping or about to sleep
+            self._wakeup.set()
+
+    # flush a GlitchFilter from the decoder thread instead of its flusher thread, so its callbacks stay in this thread
+    # and its levels are not passed on by the clock while the edges that reverse them still wait in the queue
+    def addFilter(self, glitchFilter):
+        glitchFilter.start(thread=False)
+        self._filters.append(glitchFilter)
+
+    # dequeue the oldest edge, wait if there is none, returns None when the queue is closed and empty
+    def get(self):
+        edges = self._edges
+        filters = self._filters
+        while True:
+            try:
+                return edges.popleft()
+            except IndexError:                  # queue is empty
+                pass
+            if self.closed:
+                return None
+            wakeup = None
+            if filters:
+                now = monotonic_ns()
+                if edges:                       # an edge came in meanwhile, it may be earlier than now
+                    continue
+                for glitchFilter in filters:    # all edges until now are processed, pass on the levels stable by now
+                    due = glitchFilter.due()
+                    if due is not None and due <= now:
+                        glitchFilter.flush(now)
+                        due = glitchFilter.due()
+                    if due is not None and (wakeup is None or due < wakeup):
+                        wakeup = due
+            if wakeup is None:
+                self._wakeup.wait()             # sleep until the next put() or close()
+            else:
+                self._wakeup.wait(max(0, wakeup - monotonic_ns()) / 1e9)    # or until a pending level is due
+            self._wakeup.clear()                # we check the queue again after clearing, so no edge gets lost
+
+    # call handler(*edge) for every edge until the queue is closed
+    def consume(self, handler):
+        get = self.get
+        edge = get()
+        while edge is not None:
+            handler(*edge)
+            edge = get()
+
+    # start the decoder thread that calls handler(*edge) for every edge
+    def start(self, handler):
+        self._thread = Thread(target=self.consume, args=(handler,), name='EdgeQueue', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # let the decoder thread finish after it has processed the edges still in the queue, and wait for it
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3.5
+
+# This Python module publishes the decoded encoder and button events on a local Unix socket, so other processes (media
+# player, UI, logger) can follow them instead of polling the mixer or scraping terminal output.
+# Every process that connects to the socket is a subscriber and receives all events as JSON lines, e.g.
+# {"time":1234567890,"device":"volume","event":"detent","steps":1,"direction":1,"rate":4.2,"position":17}
+# {"time":1234567899,"device":"power","event":"hold","value":2}
+# time is in nanoseconds of the monotonic clock (time.monotonic_ns() in the subscriber), rate in detents per second.
+# publish() is called on the GPIO path and never blocks: it appends the event to a queue and wakes the bus thread, if
+# it is not awake already. The bus thread takes out all queued events at once, encodes each of them once for all
+# subscribers and sends them in batches over non-blocking sockets. Each subscriber has a bounded backlog; if it does
+# not read fast enough, its oldest events are dropped and it gets {"event":"dropped","count":N} in their place. So a
+# slow or stuck subscriber neither stalls the GPIO path nor the other subscribers. The queue of publish() is bounded by
+# the backlog as well: if the bus thread falls that far behind, the oldest events are pushed out, counted in overflowed
+# and reported to all subscribers like their own dropped events.
+# Usage:
+# events = EventBus('/run/GpioDaemon.events')
+# events.start()
+# events.publish({'time': timestamp, 'device': 'volume', 'event': 'detent', 'steps': 1})
+# events.close()
+# In a subscriber:
+# for event in subscribe('/run/GpioDaemon.events'):
+#     print(event['device'], event['event'])
+# or at the terminal: python EventBus.py /run/GpioDaemon.events
+
+import json
+import os
+import select
+import socket
+import sys
+from collections import deque
+from threading import Thread
+
+
+# a connected subscriber
+class Subscriber:
+    __slots__ = ('connection', 'backlog', 'pending', 'gap', 'dropped', 'sent', 'mask')
+
+    def __init__(self, connection, backlog):
+        self.connection = connection
+        self.backlog = deque(maxlen=backlog)    # the encoded events not sent yet, the oldest are dropped when it is full
+        self.pending = b''                      # the rest of a batch that did not fit into the socket buffer
+        self.gap = 0                            # events dropped since the last batch, reported with the next one
+        self.dropped = 0                        # number of events dropped in total, for statistics
+        self.sent = 0                           # number of events sent
+        self.mask = select.POLLIN               # the events the bus thread polls the connection for
+
+
+class EventBus:
+    def __init__(self, path, backlog=1024, batch=256):
+        self.path = path                        # the Unix socket the subscribers connect to
+        self.backlog = backlog                  # maximum number of events waiting per subscriber
+        self.batch = batch                      # maximum number of events sent at once
+        self.published = 0                      # number of events published so far
+        self.dropped = 0                        # number of events dropped for slow subscribers
+        self.overflowed = 0                     # number of events pushed out of the full queue before the bus took them
+        self.subscribers = {}                   # fd: Subscriber
+        self._events = deque(maxlen=backlog)    # the events published but not yet taken out by the bus thread
+        self._signalled = False                 # the bus thread has been woken and not taken out the events yet
+        self._reported = 0                      # the overflowed events already reported to the subscribers
+        self._wakeup = os.pipe()                # publish() and close() wake the bus thread via this pipe
+        self._server = None
+        self._thread = None
+        self._closed = False
+
+    # publish an event (a dict that can be encoded as JSON), this never blocks
+    def publish(self, event):
+        events = self._events
+        if len(events) == events.maxlen:        # the append pushes out the oldest event
+            self.overflowed += 1
+        events.append(event)
+        if not self._signalled:
+            self._signalled = True
+            os.write(self._wakeup[1], b'\0')
+
+    # open the socket and start the bus thread
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)                # left behind by an earlier run
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(16)
+        self._server.setblocking(False)
+        self._thread = Thread(target=self._run, name='EventBus', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # send the events still queued, as far as the sockets take them, and close the bus
+    def close(self):
+        self._closed = True
+        os.write(self._wakeup[1], b'\0')
+        if self._thread is not None:
+            self._thread.join()
+        for subscriber in self.subscribers.values():
+            subscriber.connection.close()
+        self.subscribers.clear()
+        if self._server is not None:
+            self._server.close()
+            os.remove(self.path)
+        os.close(self._wakeup[0])
+        os.close(self._wakeup[1])
+
+    # the bus thread
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._wakeup[0], select.POLLIN)
+        poller.register(self._server, select.POLLIN)
+        server = self._server.fileno()
+        subscribers = self.subscribers
+        while True:
+            for fd, event in poller.poll():
+                if fd == self._wakeup[0]:       # publish() or close() woke us
+                    os.read(fd, 4096)
+                    self._signalled = False     # before taking out the events, so none is left behind
+                    self._distribute(poller)
+                elif fd == server:              # a new subscriber
+                    try:
+                        connection, address = self._server.accept()
+                    except OSError:
+                        continue
+                    connection.setblocking(False)
+                    subscribers[connection.fileno()] = Subscriber(connection, self.backlog)
+                    poller.register(connection, select.POLLIN)
+                elif fd in subscribers:
+                    subscriber = subscribers[fd]
+                    if event & select.POLLIN:   # subscribers do not send anything, so this is the end of the connection
+                        try:
+                            data = subscriber.connection.recv(4096)
+                        except OSError:
+                            data = b''
+                        if not data:
+                            self._remove(poller, subscriber)
+                            continue
+                    if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                        self._remove(poller, subscriber)
+                    elif event & select.POLLOUT:
+                        self._send(poller, subscriber)
+            if self._closed:
+                self._distribute(poller)
+                return
+
+    # take out the published events, encode them once and pass them on to all subscribers
+    def _distribute(self, poller):
+        events = self._events
+        lines = []
+        while events:
+            try:
+                event = events.popleft()
+            except IndexError:
+                break
+            lines.append(json.dumps(event, separators=(',', ':')).encode() + b'\n')
+        overflowed = self.overflowed - self._reported
+        self._reported += overflowed
+        if not lines:
+            return
+        self.published += len(lines)
+        for subscriber in list(self.subscribers.values()):
+            subscriber.gap += overflowed        # lost before the bus took them out, for all subscribers alike
+            subscriber.dropped += overflowed
+            backlog = subscriber.backlog
+            overflow = len(backlog) + len(lines) - backlog.maxlen
+            if overflow > 0:                    # the oldest events are pushed out
+                subscriber.gap += overflow
+                subscriber.dropped += overflow
+                self.dropped += overflow
+            backlog.extend(lines)
+            if not subscriber.mask & select.POLLOUT:    # otherwise the socket is full, wait until it is writable
+                self._send(poller, subscriber)
+
+    # send batches to a subscriber until its backlog is empty or its socket is full
+    def _send(self, poller, subscriber):
+        backlog = subscriber.backlog
+        while subscriber.pending or backlog:
+            if not subscriber.pending:
+                batch = [backlog.popleft() for i in range(min(self.batch, len(backlog)))]
+                subscriber.sent += len(batch)
+                if subscriber.gap:
+                    batch.insert(0, b'{"event":"dropped","count":%d}\n' % subscriber.gap)
+                    subscriber.gap = 0
+                subscriber.pending = b''.join(batch)
+            try:
+                sent = subscriber.connection.send(subscriber.pending)
+            except BlockingIOError:
+                break
+            except OSError:                     # the subscriber is gone
+                self._remove(poller, subscriber)
+                return
+            subscriber.pending = subscriber.pending[sent:]
+        mask = select.POLLIN | (select.POLLOUT if subscriber.pending or backlog else 0)
+        if mask != subscriber.mask:
+            subscriber.mask = mask
+            poller.modify(subscriber.connection, mask)
+
+    def _remove(self, poller, subscriber):
+        fd = subscriber.connection.fileno()
+        poller.unregister(fd)
+        del self.subscribers[fd]
+        subscriber.connection.close()
+
+
+# connect to an event bus and yield its events as dicts
+def subscribe(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        for line in connection.makefile('rb'):
+            yield json.loads(line)
+
+
+# the entry point, print the events of a bus
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('usage: python EventBus.py SOCKET')
+        sys.exit(1)
+    try:
+        for event in subscribe(sys.argv[1]):
+            print(json.dumps(event), flush=True)
+    except KeyboardInterrupt:
+        pass
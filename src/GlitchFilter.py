@@ -0,0 +1,159 @@
+#!/usr/bin/env python3.5
+
+# This Python module filters contact bounce and glitches out of the edges of GPIO pins, by their timestamps.
+# A new level of a pin is passed on only after it was stable for at least minPulse seconds, i.e. when the next edge of
+# the pin is later than that or, if none comes, when the flusher thread finds it due. Pulses shorter than minPulse
+# (bounce, glitches) are removed in pairs, bursts of bounces collapse into one edge. The edges that are passed on keep
+# their original timestamps (the start of the stable level), so press durations and rotation rates are not skewed, and
+# they are passed on in the order they came in, also across pins. Edges that repeat the last level (e.g. when RPi.GPIO
+# reads the pin only after a glitch is over) are removed as well.
+# It works the same for buttons (minPulse of a few milliseconds) and rotary encoders (some microseconds, well below the
+# time a channel is stable at the fastest rotation). TraceAnalyzer.py recommends minPulse from a captured trace.
+# The callbacks may be called from the thread that feeds the edges or from the flusher thread, but never concurrently:
+# both hold the filter's lock while they call them, so a callback that is not thread-safe itself (e.g. the decoder of
+# a script) can be wrapped as it is.
+# Instead of a flusher thread of its own, the filter can use a TimerWheel (see TimerWheel.py) shared with other filters
+# and buttons, if minPulse is not shorter than its tick. Then the callbacks run with the wheel's lock held.
+# The flusher thread and the TimerWheel find a level due by the clock, so they are only right if the edges reach the
+# filter as they happen, e.g. right in the RPi.GPIO callbacks. If they wait in an EdgeQueue first, a level may be due by
+# the clock while the edge that reverses it is still queued. So the decoder thread flushes such a filter when the queue
+# is empty, see EdgeQueue.addFilter(). Backends with an event loop in one thread (gpiochip, gpiomem, simulator) flush
+# it from that loop, when they have read all edges, see gpio.addFilter() in GpioBackend.py. Either way the callbacks
+# stay in that thread and no flusher thread is started.
+# Usage:
+# glitchFilter = GlitchFilter(0.005)
+# gpio.watch(pin, glitchFilter.wrap(callback))  # callback gets the filtered edges
+# gpio.addFilter(glitchFilter)                  # flush it from the event loop, or start() its flusher thread, behind
+#                                               # an EdgeQueue edges.addFilter(glitchFilter) instead
+# glitchFilter.close()                          # pass on the pending edges and stop the flusher thread
+# Without the flusher thread, e.g. on a recorded trace, call flush(timestamp) to pass on the edges due by timestamp.
+
+from threading import Event, Lock, Thread
+from time import monotonic_ns
+
+
+class GlitchFilter:
+    __slots__ = ('minPulse', 'levels', 'passed', 'removed', 'closed', '_minPulse', '_pending', '_lock', '_wakeup',
+                 '_thread', '_timers', '_timer')
+
+    def __init__(self, minPulse=0.005, levels=None, timers=None):
+        self.minPulse = minPulse                # minimum time in seconds a level must be stable, 0 passes all level changes right away
+        self.levels = dict(levels or {})        # last level passed on for each pin, pins not given here start at 1 (pulled up)
+        self.passed = 0                         # number of edges passed on
+        self.removed = 0                        # number of edges removed as bounce, glitch or repetition
+        self.closed = False
+        self._minPulse = int(minPulse * 1e9)    # the same in nanoseconds
+        self._pending = {}                      # pin: (level, timestamp, callback) of levels not yet stable, oldest first
+        self._lock = Lock()                     # the edges and the flusher thread take turns
+        self._wakeup = Event()                  # wakes the flusher thread when the first edge becomes pending
+        self._thread = None                     # the flusher thread, if started with start()
+        self._timers = timers                   # a TimerWheel to use instead of the flusher thread, or None
+        self._timer = None                      # the timer that passes on the oldest pending level
+        if timers is not None:
+            self._lock = timers.lock            # the timers and the edges take turns
+
+    # return a callback that filters the edges and passes the remaining ones on to callback
+    def wrap(self, callback):
+        edge = self.edge
+        return lambda pin, level, timestamp: edge(pin, level, timestamp, callback)
+
+    # process an edge, this is called in the GPIO callback or the decoder thread
+    def edge(self, pin, level, timestamp, callback):
+        with self._lock:
+            pending = self._pending
+            if pending:
+                self._flush(timestamp)          # pass on the levels that were stable until this edge, in order
+                if pin in pending:              # the new level of this pin did not last minPulse
+                    if level != pending[pin][0]:        # it is back at the last level, remove the pulse
+                        del pending[pin]
+                        self.removed += 2
+                    else:                               # a repetition of the pending level
+                        self.removed += 1
+                    return
+            if level == self.levels.get(pin, 1):        # nothing changed
+                self.removed += 1
+                return
+            if not self._minPulse:
+                self._pass(pin, level, timestamp, callback)
+                return
+            if self._timers is not None:
+                if self._timer is None:
+                    self._timer = self._timers.schedule(timestamp + self._minPulse, self._due)
+            elif not pending and not self._wakeup.is_set():
+                self._wakeup.set()              # the flusher thread has nothing to wait for yet
+            pending[pin] = (level, timestamp, callback)
+
+    # the level of pin last passed on, e.g. for a button to check it is still held, a glitch does not change it
+    def level(self, pin):
+        return self.levels.get(pin, 1)
+
+    # pass on the pending levels that are stable by timestamp (in ns), e.g. when filtering a recorded trace
+    def flush(self, timestamp):
+        with self._lock:
+            self._flush(timestamp)
+
+    # the time (monotonic, in ns) at which the oldest pending level is due, or None, for an event loop that flushes the
+    # filter, it is only called from the thread that feeds the edges
+    def due(self):
+        if self._timers is not None or not self._pending:  # nothing pending, or the TimerWheel passes it on
+            return None
+        return next(iter(self._pending.values()))[1] + self._minPulse
+
+    # start the flusher thread, it passes on pending levels when they are due by the monotonic clock, with thread=False
+    # the caller flushes instead, e.g. the event loop of a backend
+    def start(self, thread=True):
+        if self._timers is not None or not thread:  # the TimerWheel or the caller does that
+            return None
+        self._thread = Thread(target=self._run, name='GlitchFilter', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # pass on all pending levels and stop the flusher thread
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            self.flush(float('Inf'))
+
+    # the flusher thread
+    def _run(self):
+        while True:
+            self._wakeup.clear()                # edge() sets it again if something becomes pending meanwhile
+            with self._lock:
+                if self.closed:
+                    self._flush(float('Inf'))
+                    return
+                due = next(iter(self._pending.values()))[1] + self._minPulse if self._pending else None
+            if due is None:
+                self._wakeup.wait()             # sleep until an edge becomes pending or close()
+                continue
+            delay = due - monotonic_ns()
+            if delay > 0:
+                self._wakeup.wait(delay / 1e9)
+            else:
+                self.flush(monotonic_ns())
+
+    # the timer of the oldest pending level, it runs with the lock held
+    def _due(self):
+        self._timer = None
+        self._flush(self._timers.now)
+        if self._pending:                       # the next pending level
+            self._timer = self._timers.schedule(next(iter(self._pending.values()))[1] + self._minPulse, self._due)
+
+    # pass on the pending levels, oldest first, until one is not yet stable by timestamp, the lock must be held
+    def _flush(self, timestamp):
+        pending = self._pending
+        while pending:
+            pin = next(iter(pending))
+            level, edgeTime, callback = pending[pin]
+            if timestamp - edgeTime < self._minPulse:
+                return
+            del pending[pin]
+            self._pass(pin, level, edgeTime, callback)
+
+    def _pass(self, pin, level, timestamp, callback):
+        self.levels[pin] = level
+        self.passed += 1
+        callback(pin, level, timestamp)
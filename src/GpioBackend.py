@@ -0,0 +1,417 @@
+#!/usr/bin/env python3.5
+
+# This Python module provides the GPIO input backends for the scripts in this directory.
+# All backends call callback(pin, level, timestamp) on both edges of a watched pin; pins are BCM numbers (RPi.GPIO) or
+# line offsets (gpiochip, on the Pi these are the same), level is 0 or 1 and timestamp is in nanoseconds of the
+# monotonic clock (the same as time.monotonic_ns()).
+# - RPiGPIOBackend uses RPi.GPIO.add_event_detect(). The callbacks come from the RPi.GPIO thread, the main thread just
+#   idles in run(). The timestamp is taken in the callback.
+# - GpioChipBackend uses the Linux GPIO character device (/dev/gpiochipN, kernel 5.10 or newer). All watched pins are
+#   requested together in one line request and run() reads their edge events in batches with one epoll loop. There is
+#   no other thread, the callbacks run in the thread that calls run(), and the timestamps come from the kernel. It can
+#   be tested with the kernel's gpio-sim module, or with a fake event fd by overriding _requestLines() and writing
+#   events made with packEvent().
+# - GpioMemBackend samples the GPIO level register of the BCM283x/BCM2711 (Pi 1 to 4) through an mmap of /dev/gpiomem
+#   at a fixed rate, in the thread that calls run(). One word read gives the levels of all pins at the same moment, so
+#   the two channels of an encoder never come from different times (snapshots), and the callbacks are only called for
+#   the pins that changed since the last sample. Edges shorter than a sample period are not seen, there are no
+#   interrupts and no kernel timestamps. The pull-ups are not set by this backend, set them in /boot/config.txt, e.g.
+#   gpio=23,24,27=ip,pu. Any file of at least 56 bytes can be passed as path, a fake register for testing, e.g. written
+#   by GpioSimulator.writeRegister().
+# - SimulatedBackend (see GpioSimulator.py) replays recorded or scripted edge traces, so the scripts can be run and
+#   measured without a Pi.
+# Usage:
+# gpio = openBackend('gpiochip')        # or 'RPi.GPIO', 'gpiomem'
+# gpio.watch(23, callback)
+# gpio.start()                          # arm edge detection after all pins are watched
+# gpio.tick(callback, 5)                # optional, run() calls callback() about every 5 s, e.g. for watchdog pings
+# gpio.addFilter(glitchFilter)          # flush a GlitchFilter from run() (gpiochip, gpiomem) or start its thread,
+#                                       # behind an EdgeQueue (RPi.GPIO) use edges.addFilter() instead
+# gpio.run()                            # returns after gpio.stop()
+# gpio.cleanup()
+
+import fcntl
+import mmap
+import os
+import select
+import struct
+from threading import Event
+from time import sleep, monotonic_ns
+
+
+# the RPi.GPIO backend
+class RPiGPIOBackend:
+    threadedCallbacks = True    # the callbacks come from another thread than run()
+    snapshots = False           # input() reads the pin now, not together with the edge
+
+    def __init__(self):
+        from RPi import GPIO
+        self.GPIO = GPIO
+        self._stopped = Event()
+        self._tick = None
+        self._tickInterval = 60
+        GPIO.setmode(GPIO.BCM)                                  # set the GPIO naming/numbering convention to BCM
+
+    # set up pin as input with pull up and call callback(pin, level, timestamp) on both edges
+    def watch(self, pin, callback, bouncetime=0):
+        GPIO = self.GPIO
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        interrupt = lambda channel: callback(channel, GPIO.input(channel), monotonic_ns())
+        if bouncetime:                                          # in milliseconds, as in RPi.GPIO
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=interrupt, bouncetime=bouncetime)
+        else:
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=interrupt)
+
+    # nothing to do, RPi.GPIO detects edges right after watch()
+    def start(self):
+        pass
+
+    # read the current level of a pin
+    def input(self, pin):
+        return self.GPIO.input(pin)
+
+    # call callback() from run() about every interval seconds
+    def tick(self, callback, interval):
+        self._tick = callback
+        self._tickInterval = interval
+
+    # a GlitchFilter fed right in the RPi.GPIO callbacks needs its flusher thread, one behind an EdgeQueue is flushed by
+    # the decoder thread instead, see EdgeQueue.addFilter()
+    def addFilter(self, glitchFilter):
+        glitchFilter.start()
+
+    # idle until stop() is called, the callbacks come from the RPi.GPIO thread
+    def run(self):
+        self._stopped.clear()
+        while not self._stopped.wait(self._tickInterval):      # wakes up once every tick interval, or at stop()
+            if self._tick is not None:
+                self._tick()
+
+    # let run() return, this may be called from any thread or from a signal handler
+    def stop(self):
+        self._stopped.set()
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+# GPIO character device ABI v2, see linux/gpio.h
+GPIO_V2_LINES_MAX = 64
+GPIO_V2_LINE_NUM_ATTRS_MAX = 10
+GPIO_V2_GET_LINE_IOCTL = 0xC250B407             # _IOWR(0xB4, 0x07, struct gpio_v2_line_request)
+GPIO_V2_LINE_GET_VALUES_IOCTL = 0xC010B40E      # _IOWR(0xB4, 0x0E, struct gpio_v2_line_values)
+GPIO_V2_LINE_FLAG_INPUT = 1 << 2
+GPIO_V2_LINE_FLAG_OUTPUT = 1 << 3               # not requested, the kernel refuses INPUT together with OUTPUT
+GPIO_V2_LINE_FLAG_EDGE_RISING = 1 << 4
+GPIO_V2_LINE_FLAG_EDGE_FALLING = 1 << 5
+GPIO_V2_LINE_FLAG_BIAS_PULL_UP = 1 << 8
+GPIO_V2_LINE_ATTR_ID_DEBOUNCE = 3
+GPIO_V2_LINE_EVENT_RISING_EDGE = 1
+GPIO_V2_LINE_EVENT_FALLING_EDGE = 2
+
+# struct gpio_v2_line_request: offsets, consumer, config (flags, num_attrs, attrs), num_lines, event_buffer_size, fd,
+# each attr is a struct gpio_v2_line_config_attribute: id, padding, value (e.g. debounce_period_us), mask
+LINE_REQUEST = struct.Struct('<%dI32sQI20x%sII20xi' % (GPIO_V2_LINES_MAX, 'I4xQQ' * GPIO_V2_LINE_NUM_ATTRS_MAX))
+LINE_VALUES = struct.Struct('<QQ')              # struct gpio_v2_line_values: bits, mask
+LINE_EVENT = struct.Struct('<QIIII24x')         # struct gpio_v2_line_event: timestamp_ns, id, offset, seqno, line_seqno
+
+
+# make a line event as the kernel would deliver it, e.g. to write it into a fake event fd
+def packEvent(timestamp, offset, level, seqno=0):
+    return LINE_EVENT.pack(timestamp, GPIO_V2_LINE_EVENT_RISING_EDGE if level else GPIO_V2_LINE_EVENT_FALLING_EDGE,
+                           offset, seqno, seqno)
+
+
+# pack a struct gpio_v2_line_request for pins (input, both edges, pull-up), debounces are their debounce periods in
+# microseconds, 0 for none
+def packLineRequest(pins, debounces, consumer):
+    if len(pins) > GPIO_V2_LINES_MAX:
+        raise ValueError('at most %d lines per chip' % GPIO_V2_LINES_MAX)
+    attrs = []
+    for debounce in sorted(set(debounce for debounce in debounces if debounce)):
+        mask = 0
+        for index, lineDebounce in enumerate(debounces):
+            if lineDebounce == debounce:
+                mask |= 1 << index              # the mask addresses the lines by their index in the request
+        attrs.append((GPIO_V2_LINE_ATTR_ID_DEBOUNCE, debounce, mask))
+    if len(attrs) > GPIO_V2_LINE_NUM_ATTRS_MAX:
+        raise ValueError('at most %d different debounce periods per chip' % GPIO_V2_LINE_NUM_ATTRS_MAX)
+    flags = (GPIO_V2_LINE_FLAG_INPUT | GPIO_V2_LINE_FLAG_EDGE_RISING | GPIO_V2_LINE_FLAG_EDGE_FALLING
+             | GPIO_V2_LINE_FLAG_BIAS_PULL_UP)
+    attrFields = []
+    for attr in attrs + [(0, 0, 0)] * (GPIO_V2_LINE_NUM_ATTRS_MAX - len(attrs)):
+        attrFields.extend(attr)
+    return bytearray(LINE_REQUEST.pack(*(list(pins) + [0] * (GPIO_V2_LINES_MAX - len(pins))), consumer.encode()[:31],
+                                       flags, len(attrs), *attrFields, len(pins), 0, 0))
+
+
+# the GPIO character device backend
+class GpioChipBackend:
+    threadedCallbacks = False   # the callbacks run in the thread that calls run()
+    snapshots = False           # input() gives the level after the last event of the pin
+
+    def __init__(self, path='/dev/gpiochip0', consumer='Raspberry-Pi-Tools', eventBatch=64):
+        self.path = path                    # the GPIO chip, on the Pi the 40 pin header is on gpiochip0
+        self.consumer = consumer            # shows up as the user of the lines, e.g. in gpioinfo
+        self.eventBatch = eventBatch        # maximum number of events read at once
+        self.levels = {}                    # last known level of each watched pin
+        self._watched = []                  # (pin, callback, debounce period in microseconds)
+        self._callbacks = {}
+        self._lineFd = None
+        self._readers = {}                  # handlers of the file descriptors in the epoll loop
+        self._epoll = select.epoll()
+        self._wakeup = os.pipe()            # stop() wakes the loop via this pipe
+        self._running = False
+        self._tick = None
+        self._tickInterval = None
+        self._filters = []                  # the GlitchFilters flushed by the loop
+        self.addReader(self._wakeup[0], lambda: os.read(self._wakeup[0], 4096))
+
+    # set up pin as input with pull up and call callback(pin, level, timestamp) on both edges
+    def watch(self, pin, callback, bouncetime=0):
+        if self._lineFd is not None:
+            raise RuntimeError('all pins must be watched before start()')
+        self._watched.append((pin, callback, bouncetime * 1000))
+        self._callbacks[pin] = callback
+
+    # request the watched lines and read their current levels
+    def start(self):
+        self._lineFd, levels = self._requestLines()
+        self.levels.update(levels)
+        self.addReader(self._lineFd, self._readEvents)
+
+    # read the current level of a pin, this is up to date with the events dispatched so far
+    def input(self, pin):
+        return self.levels[pin]
+
+    # call handler() in the loop whenever fd is readable, e.g. for sockets that should be served by the same thread
+    def addReader(self, fd, handler):
+        self._readers[fd] = handler
+        self._epoll.register(fd, select.EPOLLIN)
+
+    def removeReader(self, fd):
+        del self._readers[fd]
+        self._epoll.unregister(fd)
+
+    # call callback() from run() about every interval seconds, between the events
+    def tick(self, callback, interval):
+        self._tick = callback
+        self._tickInterval = interval
+
+    # pass on the pending levels of a GlitchFilter from the loop when they are due, instead of its flusher thread, so
+    # the callbacks stay in the thread that calls run()
+    def addFilter(self, glitchFilter):
+        glitchFilter.start(thread=False)
+        self._filters.append(glitchFilter)
+
+    # the event loop, it dispatches the edge events until stop() is called
+    def run(self):
+        self._running = True
+        readers = self._readers
+        poll = self._epoll.poll
+        tick = self._tick
+        filters = self._filters
+        if tick is None and not filters:    # nothing to do between the events
+            while self._running:
+                for fd, events in poll():
+                    readers[fd]()
+            return
+        interval = int(self._tickInterval * 1e9) if tick is not None else 0
+        nextTick = monotonic_ns() + interval if tick is not None else None
+        while self._running:
+            wakeup = nextTick
+            for glitchFilter in filters:    # wake up when a pending level becomes stable
+                due = glitchFilter.due()
+                if due is not None and (wakeup is None or due < wakeup):
+                    wakeup = due
+            ready = poll(-1 if wakeup is None else max(0, wakeup - monotonic_ns()) / 1e9)
+            for fd, events in ready:
+                readers[fd]()
+            now = monotonic_ns()
+            if not ready:                   # no edge waits in the kernel, so the pending levels are stable until now
+                for glitchFilter in filters:
+                    due = glitchFilter.due()
+                    if due is not None and due <= now:
+                        glitchFilter.flush(now)
+            if nextTick is not None and now >= nextTick:
+                tick()
+                nextTick = now + interval
+
+    # let run() return, this may be called from any thread or from a callback
+    def stop(self):
+        self._running = False
+        os.write(self._wakeup[1], b'\0')
+
+    def cleanup(self):
+        if self._lineFd is not None:
+            self.removeReader(self._lineFd)
+            os.close(self._lineFd)
+            self._lineFd = None
+        self._epoll.close()
+        os.close(self._wakeup[0])
+        os.close(self._wakeup[1])
+
+    # request all watched lines with one GPIO_V2_GET_LINE_IOCTL, returns the line request fd and the current levels
+    def _requestLines(self):
+        pins = [pin for pin, callback, debounce in self._watched]
+        request = packLineRequest(pins, [debounce for pin, callback, debounce in self._watched], self.consumer)
+
+        chipFd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(chipFd, GPIO_V2_GET_LINE_IOCTL, request)
+        finally:
+            os.close(chipFd)
+        lineFd = LINE_REQUEST.unpack(request)[-1]
+
+        values = bytearray(LINE_VALUES.pack(0, (1 << len(pins)) - 1))
+        fcntl.ioctl(lineFd, GPIO_V2_LINE_GET_VALUES_IOCTL, values)
+        bits = LINE_VALUES.unpack(values)[0]
+        return lineFd, {pin: bits >> index & 1 for index, pin in enumerate(pins)}
+
+    # read a batch of edge events and dispatch them
+    def _readEvents(self):
+        data = os.read(self._lineFd, LINE_EVENT.size * self.eventBatch)
+        levels = self.levels
+        callbacks = self._callbacks
+        for timestamp, eventId, pin, seqno, lineSeqno in LINE_EVENT.iter_unpack(data):
+            level = 1 if eventId == GPIO_V2_LINE_EVENT_RISING_EDGE else 0
+            levels[pin] = level
+            callbacks[pin](pin, level, timestamp)
+
+
+GPLEV0 = 0x34           # offset of the level register of the pins 0 to 31 in the GPIO block
+
+
+# the /dev/gpiomem sampling backend
+class GpioMemBackend:
+    threadedCallbacks = False   # the callbacks run in the thread that calls run()
+    snapshots = True            # in a callback, input() gives the levels of all pins of the same sample
+
+    def __init__(self, path='/dev/gpiomem', rate=10000, register=GPLEV0):
+        self.path = path                    # the GPIO block, or a file that fakes it
+        self.rate = rate                    # samples per second, 0 samples as fast as possible (one CPU core)
+        self.levels = {}                    # level of each watched pin in the last sample
+        self.samples = 0                    # number of samples taken, for statistics
+        self.changes = 0                    # number of samples in which a watched pin changed
+        self._watched = []                  # (pin, bit, callback)
+        self._mask = 0                      # the bits of the watched pins
+        self._last = 0                      # the watched bits of the last sample
+        fd = os.open(path, os.O_RDONLY | os.O_SYNC | os.O_CLOEXEC)
+        try:
+            self._map = mmap.mmap(fd, register + 4, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        self._words = memoryview(self._map).cast('I')      # the registers are 32 bit words, little endian like the CPU
+        self._index = register // 4
+        self._running = False
+        self._tick = None
+        self._tickInterval = None
+        self._filters = []                  # the GlitchFilters flushed by the loop
+
+    # call callback(pin, level, timestamp) when pin changed between two samples, bouncetime is ignored, the sampling
+    # does not see pulses much shorter than its period anyway
+    def watch(self, pin, callback, bouncetime=0):
+        if not 0 <= pin < 32:
+            raise ValueError('pin %d is not in the level register' % pin)
+        self._watched.append((pin, 1 << pin, callback))
+        self._mask |= 1 << pin
+
+    # take the first sample, the callbacks are called for changes from here on
+    def start(self):
+        self._last = self._words[self._index] & self._mask
+        for pin, bit, callback in self._watched:
+            self.levels[pin] = 1 if self._last & bit else 0
+
+    # the level of a watched pin in the last sample, or the current level of another pin
+    def input(self, pin):
+        if pin in self.levels:
+            return self.levels[pin]
+        return self._words[self._index] >> pin & 1
+
+    # call callback() from run() about every interval seconds, between the samples
+    def tick(self, callback, interval):
+        self._tick = callback
+        self._tickInterval = interval
+
+    # pass on the pending levels of a GlitchFilter from the sampling loop when they are due, instead of its flusher
+    # thread, so the callbacks stay in the thread that calls run()
+    def addFilter(self, glitchFilter):
+        glitchFilter.start(thread=False)
+        self._filters.append(glitchFilter)
+
+    # the sampling loop, it calls the callbacks of the changed pins until stop() is called
+    def run(self):
+        self._running = True
+        words = self._words
+        index = self._index
+        mask = self._mask
+        last = self._last
+        watched = self._watched
+        levels = self.levels
+        filters = self._filters
+        period = int(1e9 / self.rate) if self.rate else 0
+        tick = self._tick
+        tickInterval = int(self._tickInterval * 1e9) if tick is not None else 0
+        now = monotonic_ns()
+        nextSample = now
+        nextTick = now + tickInterval if tick is not None else 1 << 63
+        samples = changes = 0
+        while self._running:
+            timestamp = monotonic_ns()
+            word = words[index] & mask
+            samples += 1
+            if word != last:
+                changes += 1
+                changed = word ^ last
+                last = word
+                for pin, bit, callback in watched:          # all levels first, so input() gives the whole sample
+                    if changed & bit:
+                        levels[pin] = 1 if word & bit else 0
+                for pin, bit, callback in watched:
+                    if changed & bit:
+                        callback(pin, levels[pin], timestamp)
+            for glitchFilter in filters:                    # pass on the levels that were stable until this sample
+                due = glitchFilter.due()
+                if due is not None and due <= timestamp:
+                    glitchFilter.flush(timestamp)
+            now = monotonic_ns()
+            if now >= nextTick:
+                tick()
+                nextTick = now + tickInterval
+            if period:
+                nextSample += period
+                delay = nextSample - now
+                if delay > 0:
+                    sleep(delay / 1e9)
+                elif delay < -period:                       # too late for more than a sample, e.g. after a slow callback
+                    nextSample = now                        # skip those samples instead of taking them in a burst
+        self._last = last
+        self.samples += samples
+        self.changes += changes
+
+    # let run() return, this may be called from any thread, from a callback or from a signal handler
+    def stop(self):
+        self._running = False
+
+    def cleanup(self):
+        self._words.release()
+        self._map.close()
+
+
+# the simulator backend, GpioSimulator.py is imported only now, the scripts do not need it on a Pi
+def openSimulator(**arguments):
+    from GpioSimulator import SimulatedBackend
+    return SimulatedBackend(**arguments)
+
+
+BACKENDS = {
+    'RPi.GPIO': RPiGPIOBackend,
+    'gpiochip': GpioChipBackend,
+    'gpiomem': GpioMemBackend,
+    'simulator': openSimulator}
+
+
+# create a backend by its name, further arguments are passed on, e.g. path='/dev/gpiochip1' for gpiochip, rate=20000 for
+# gpiomem or trace=... for simulator
+def openBackend(name='RPi.GPIO', **arguments):
+    return BACKENDS[name](**arguments)
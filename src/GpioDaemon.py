@@ -0,0 +1,299 @@
+#!/usr/bin/env python3.5
+
+# This Python script serves any number of rotary encoders and buttons from one process, as configured in a config file
+# (see GpioDaemon.ini, put it into the same directory or pass its path as argument). Each encoder or button is a small
+# object of GpioDevices.py, a single dispatcher passes the edges of all pins on to them. All devices share one GPIO
+# backend, one edge queue with one decoder thread (RPi.GPIO only), one timer thread for the gestures of all buttons,
+# one glitch filter per minPulse value and one VolumeMixer per mixer control. The glitch filters are flushed by the
+# decoder thread or the event loop, which also feed them the edges. So memory and threads stay about the same when
+# devices are added.
+# It requires GpioBackend.py, GpioDevices.py, QuadratureDecoder.py, EdgeQueue.py, GlitchFilter.py, TimerWheel.py,
+# EdgeCapture.py, PowerAction.py, Metrics.py, EventBus.py, Systemd.py, VolumeMixer.py and RotaryAcceleration.py in the
+# same directory, and python-alsaaudio for the volume action. The modules that are not needed for arming edge
+# detection (alsaaudio, Metrics, EventBus) are imported only when used, the ALSA mixer on the first detent.
+# Put it to a location on your Pi, say /home/pi/myTools/, and install it as systemd service (see GpioDaemon.service):
+# it tells systemd when edge detection is armed, pings its watchdog and is restarted when it fails. Or add the
+# following line to /etc/rc.local before exit 0:
+# python /home/pi/myTools/GpioDaemon.py /home/pi/myTools/GpioDaemon.ini&
+# kill -USR1 PID writes the last edges of all pins to captureFile.
+# With metricsFile or metricsSocket set, Metrics.py counts and times edges, decoder errors, mixer writes and presses and
+# exports them for Prometheus. Without, the metrics are off and cost nothing.
+# With eventSocket set, the detents, presses and gestures of all devices are published there for other processes, see
+# EventBus.py.
+# Other scripts can add devices with addDevice() and then call init() and serve(), see ShutdownRebootVolumeControl.py.
+
+import configparser
+import os
+import shlex
+import sys
+from GpioBackend import openBackend
+import GpioDevices
+from GpioDevices import Encoder, Button, volumeAction, printDetents, printGesture, reboot, shutdown
+from QuadratureDecoder import FULL_STEP, HALF_STEP, QUARTER_STEP
+from RotaryAcceleration import RotaryAcceleration
+from EdgeQueue import EdgeQueue
+from GlitchFilter import GlitchFilter
+from TimerWheel import TimerWheel
+from EdgeCapture import EdgeCapture
+import Systemd
+
+
+RESOLUTIONS = {'full': FULL_STEP, 'half': HALF_STEP, 'quarter': QUARTER_STEP}
+BUTTON_ACTIONS = {'reboot': reboot, 'shutdown': shutdown, 'print': printGesture, 'none': None}
+BUTTON_PRESETS = {                      # the gestures set by the option action of a button
+    'power': {'hold': '2 reboot, 5 shutdown'},
+    'print': {'press': 'print', 'double': 'print', 'hold': '2 print', 'turn': 'print'}}
+
+configFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GpioDaemon.ini')    # used if no path is passed as argument
+GPIObackend = 'RPi.GPIO'    # set 'gpiochip' to read the pins via the Linux GPIO character device (one thread, kernel timestamps)
+devices = []                # the Encoder and Button objects
+handlers = {}               # the edge handler of each pin, this is the device's edge(), maybe behind a glitch filter
+edges = EdgeQueue(1024)     # with RPi.GPIO, the interrupts put the edges of all pins in here, the decoder thread dispatches them
+filters = {}                # the glitch filters by their minPulse in seconds, shared by the devices
+timers = TimerWheel(0.01)   # times the gestures of all buttons
+mixers = {}                 # the VolumeMixers by their mixer control, shared by the devices
+capture = None              # an EdgeCapture of all pins, or None
+captureFile = '/tmp/GpioDaemon.trace'   # kill -USR1 PID writes the captured edges to this file
+metricsFile = None          # write the metrics to this file every metricsInterval, e.g. for the node exporter's textfile collector
+metricsSocket = None        # or serve them on this Unix socket, both None switch the metrics off
+metricsInterval = 15        # seconds
+metrics = None              # the Metrics, if switched on, set up in init()
+eventSocket = None          # publish the events of all devices on this Unix socket, e.g. '/run/GpioDaemon.events', None for no event bus
+eventBacklog = 1024         # events waiting per subscriber, a slow subscriber loses the oldest ones
+events = None               # the EventBus, if switched on, set up in init()
+backendOptions = {}         # further arguments of the GPIO backend, e.g. the trace of the simulator
+gpio = None                 # the GPIO backend, it is opened in init()
+
+
+# add a device, its edges pass a glitch filter with minPulse seconds (0 for none)
+def addDevice(device, minPulse=0):
+    handler = device.edge
+    if minPulse:
+        if minPulse not in filters:             # flushed where the edges are processed, see init()
+            filters[minPulse] = GlitchFilter(minPulse)
+        handler = filters[minPulse].wrap(handler)
+        if isinstance(device, Button):          # check the filtered level before a hold action, not the raw pin
+            device.input = filters[minPulse].level
+    for pin in device.pins:
+        if pin in handlers:
+            raise ValueError('pin %d of %s is already used' % (pin, device.name))
+        handlers[pin] = handler
+    devices.append(device)
+    return device
+
+
+# get the VolumeMixer of a mixer control, the ALSA mixer is opened on the first detent
+def openMixer(control='Master', interval=0.005):
+    if control not in mixers:
+        from VolumeMixer import VolumeMixer
+        mixers[control] = VolumeMixer(control, interval)
+    return mixers[control]
+
+
+# read the config file and add its devices
+def loadConfig(path):
+    global GPIObackend, capture, captureFile, metricsFile, metricsSocket, metricsInterval, eventSocket, eventBacklog
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError('config file %s not found' % path)
+    if config.has_section('daemon'):
+        daemon = config['daemon']
+        GPIObackend = daemon.get('backend', GPIObackend)
+        if GPIObackend == 'simulator':          # replay a captured or saved trace instead of reading the pins
+            from GpioSimulator import loadTrace
+            backendOptions.update(trace=loadTrace(daemon['trace']), speed=daemon.getfloat('speed', 1))
+        elif GPIObackend == 'gpiomem':          # sample the level register
+            backendOptions.update(path=daemon.get('gpiomem', '/dev/gpiomem'), rate=daemon.getfloat('sampleRate', 10000))
+        captureFile = daemon.get('captureFile', captureFile)
+        captureSize = daemon.getint('captureSize', 65536)
+        capture = EdgeCapture(captureSize) if captureSize else None
+        metricsFile = daemon.get('metricsFile') or None
+        metricsSocket = daemon.get('metricsSocket') or None
+        metricsInterval = daemon.getfloat('metricsInterval', metricsInterval * 1000) / 1000
+        eventSocket = daemon.get('eventSocket') or None
+        eventBacklog = daemon.getint('eventBacklog', eventBacklog)
+        power = GpioDevices.power               # the reboot and shutdown actions of the buttons
+        power.hookTimeout = daemon.getfloat('hookTimeout', power.hookTimeout * 1000) / 1000
+        power.deadline = daemon.getfloat('powerDeadline', power.deadline * 1000) / 1000
+        for hook in daemon.get('preShutdownHooks', '').splitlines():
+            if hook.strip():
+                power.addHook(shlex.split(hook))
+
+    modifiers = {}                              # encoder name: the button for press-and-turn
+    for name in config.sections():
+        if name == 'daemon':
+            continue
+        section = config[name]
+        kind = section.get('type')
+        if kind == 'encoder':
+            action = section.get('action', 'print')
+            if action == 'volume':
+                callback = volumeAction(openMixer(section.get('control', 'Master'), section.getfloat('mixerInterval', 5) / 1000))
+            elif action == 'print':
+                callback = printDetents
+            else:
+                raise ValueError('%s: unknown encoder action %s' % (name, action))
+            acceleration = RotaryAcceleration() if section.getboolean('acceleration', False) else None
+            addDevice(Encoder(name, section.getint('pinA'), section.getint('pinB'), callback,
+                              RESOLUTIONS[section.get('resolution', 'full')], acceleration),
+                      section.getfloat('minPulse', 0.02) / 1000)
+        elif kind == 'button':
+            preset = section.get('action')      # a preset of gestures, or none to give them one by one
+            if preset is not None and preset not in BUTTON_PRESETS:
+                raise ValueError('%s: unknown button action %s, use %s' % (name, preset, ', '.join(sorted(BUTTON_PRESETS))))
+            gestures = dict(BUTTON_PRESETS.get(preset, {}))
+            for gesture in ('press', 'double', 'hold', 'turn', 'feedback'):
+                if gesture in section:
+                    gestures[gesture] = section[gesture]
+            try:
+                hold = {float(seconds): BUTTON_ACTIONS[action] for seconds, action in
+                        (threshold.split() for threshold in gestures.pop('hold', '').split(',') if threshold.strip())}
+                gestures = {gesture: BUTTON_ACTIONS[action] for gesture, action in gestures.items()}
+            except (KeyError, ValueError) as error:
+                raise ValueError('%s: unknown button action or bad hold threshold %s' % (name, error))
+            button = addDevice(Button(name, section.getint('pin'), timers, hold,
+                                      doubleTime=section.getfloat('doubleTime', 400) / 1000, **gestures),
+                               section.getfloat('minPulse', 10) / 1000)
+            if 'encoder' in section:
+                modifiers[section['encoder']] = button
+        else:
+            raise ValueError('%s: unknown type %s, use encoder or button' % (name, kind))
+
+    for device in devices:                      # press-and-turn
+        if device.name in modifiers:
+            device.modifier = modifiers.pop(device.name)
+    if modifiers:
+        raise ValueError('no encoder %s for press-and-turn' % ', '.join(modifiers))
+
+
+# initialize GPIO input for all devices, a backend can be passed in, e.g. a SimulatedBackend
+def init(backend=None):
+    global gpio, metrics, events                                # get access to the global backend, metrics and event bus variables
+    gpio = backend or openBackend(GPIObackend, **backendOptions)    # open the GPIO backend
+    if eventSocket:                                             # publish the events of all devices
+        from EventBus import EventBus
+        events = EventBus(eventSocket, eventBacklog)
+        for device in devices:
+            device.events = events
+        events.start()
+    handler = dispatch
+    if metricsFile or metricsSocket:                            # time every edge, also how long it waited in the queue
+        from Metrics import Metrics
+        metrics = Metrics()
+        instrument()
+        handler = metrics.wrapEdges(handler)
+    if gpio.threadedCallbacks:                                  # RPi.GPIO calls back from its own thread
+        callback = enqueue                                      # so only enqueue there
+        edges.start(handler)                                    # and dispatch in the decoder thread
+    else:                                                       # the gpiochip event loop runs in the main thread
+        callback = handler                                      # so it can dispatch right away
+    if capture:                                                 # record every edge before it is processed
+        callback = capture.wrap(callback)
+        capture.dumpOnSignal(captureFile)
+    for pin in handlers:
+        gpio.watch(pin, callback)                               # input with pull up, react on both edges
+    gpio.start()                                                # start edge detection
+    levels = {pin: gpio.input(pin) for pin in handlers}         # read the current levels
+    for device in devices:
+        if isinstance(device, Encoder):                         # start decoding from them
+            device.reset(levels[device.pinA], levels[device.pinB])
+            if gpio.snapshots:                                  # and read both channels of the same sample (gpiomem)
+                device.input = gpio.input
+        elif device.input is None:                              # unfiltered buttons check their pin before a hold action
+            device.input = gpio.input
+    for glitchFilter in filters.values():
+        glitchFilter.levels.update(levels)                      # the filters start from them, too
+        if gpio.threadedCallbacks:
+            edges.addFilter(glitchFilter)                       # flushed from the decoder thread when the queue is empty
+        else:
+            gpio.addFilter(glitchFilter)                        # flushed from the event loop
+    timers.start()                                              # start the timer thread
+    if metrics:
+        metrics.start(metricsFile, metricsSocket, metricsInterval)  # start exporting
+
+
+# register the counters the objects keep anyway and attach histograms to the mixers and buttons
+def instrument():
+    from Metrics import DURATION_BUCKETS
+    metrics.collect('gpio_edges_dropped_total', 'Edges pushed out of the full edge queue.', lambda: edges.dropped)
+    for device in devices:
+        if isinstance(device, Encoder):
+            decoder = device.decoder
+            metrics.collect('encoder_invalid_total', 'Invalid channel transitions.', lambda decoder=decoder: decoder.invalid,
+                            device=device.name)
+            metrics.collect('encoder_position', 'Detents turned since the start.', lambda decoder=decoder: decoder.position,
+                            'gauge', device=device.name)
+        else:
+            device.durations = metrics.histogram('button_press_seconds', 'Durations of the button presses.',
+                                                 DURATION_BUCKETS, device=device.name)
+    for minPulse, glitchFilter in filters.items():
+        metrics.collect('glitch_filter_passed_total', 'Edges passed on by the glitch filter.',
+                        lambda glitchFilter=glitchFilter: glitchFilter.passed, min_pulse=minPulse)
+        metrics.collect('glitch_filter_removed_total', 'Edges removed by the glitch filter.',
+                        lambda glitchFilter=glitchFilter: glitchFilter.removed, min_pulse=minPulse)
+    for control, mixer in mixers.items():
+        mixer.latency = metrics.histogram('mixer_write_seconds', 'Durations of the mixer writes.', control=control)
+        metrics.collect('mixer_external_changes_total', 'Volume changes by other programs.',
+                        lambda mixer=mixer: mixer.externalChanges, control=control)
+    metrics.collect('timer_wheel_fired_total', 'Timers fired for gestures.', lambda: timers.fired)
+    metrics.collect('timer_wheel_running', 'Timers running.', lambda: timers.count, 'gauge')
+    if events:
+        metrics.collect('events_published_total', 'Events published on the event bus.', lambda: events.published)
+        metrics.collect('events_dropped_total', 'Events dropped for slow subscribers.', lambda: events.dropped)
+        metrics.collect('events_overflowed_total', 'Events pushed out of the full publish queue.',
+                        lambda: events.overflowed)
+        metrics.collect('events_subscribers', 'Processes subscribed to the event bus.', lambda: len(events.subscribers), 'gauge')
+
+
+# the callback of the RPi.GPIO thread, it only enqueues the edge
+def enqueue(GPIOpin, level, timestamp):
+    edges.put((GPIOpin, level, timestamp))
+
+
+# pass an edge on to its device, from the decoder thread or the gpiochip event loop
+def dispatch(GPIOpin, level, timestamp):
+    handlers[GPIOpin](GPIOpin, level, timestamp)
+
+
+# the threads that must be running, checked before each watchdog ping, e.g. a mixer thread ends if ALSA fails to open
+def healthy():
+    return ((edges._thread is None or edges._thread.is_alive()) and timers._thread.is_alive()
+            and all(mixer._thread.is_alive() for mixer in mixers.values())
+            and (events is None or events._thread.is_alive()))
+
+
+# tell systemd we are ready, then dispatch the GPIO events until CTRL+C or SIGTERM, then shut everything down
+def serve():
+    Systemd.ready(gpio, healthy, '%d devices on %d pins' % (len(devices), len(handlers)))
+    try:
+        gpio.run()              # dispatch the GPIO events (gpiochip) or idle (RPi.GPIO), ping the watchdog
+    except KeyboardInterrupt:   # CTRL+C exit
+        pass
+    close()
+
+
+# stop the threads and write the last volume changes
+def close():
+    Systemd.notify('STOPPING=1')
+    gpio.cleanup()              # clean up GPIO
+    edges.close()               # let the decoder thread finish
+    for glitchFilter in filters.values():
+        glitchFilter.close()    # pass on the last filtered edges
+    timers.close()              # stop the timer thread
+    for mixer in mixers.values():
+        mixer.close()           # write the last volume change
+    if metrics:
+        metrics.close()         # write the metrics file a last time
+    if events:
+        events.close()          # send the last events
+
+
+# the main function
+def main():
+    loadConfig(sys.argv[1] if len(sys.argv) > 1 else configFile)
+    init()
+    serve()
+
+# the entry point
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3.5
+
+# This Python module holds the encoder and button logic of the scripts in this directory as small per-device objects,
+# so one process can serve any number of encoders and buttons (see GpioDaemon.py). The state of a device lives in its
+# object instead of module globals, each object has __slots__ and no thread of its own.
+# Every device has the method edge(pin, level, timestamp) that takes the edges of its pins, and pins, the tuple of
+# them. What the device does is up to its action:
+# - Encoder calls action(encoder, steps) for every completed detent, steps is + for -> and - for <-, scaled by the
+#   RotaryAcceleration, if any. Actions are, e.g., VolumeMixer.change (through volumeAction()) or printDetents().
+#   With input set to the input() of a backend with snapshots (gpiomem), it reads both channels on every edge, so
+#   channels that changed in the same sample reach the decoder together.
+# - Button recognizes gestures and calls action(button, gesture, value) for them. The timing runs on a TimerWheel
+#   (see TimerWheel.py), which can be shared by any number of buttons, there is no thread per button or press.
+#   - hold: {seconds: action}, the longest threshold fires the moment it is crossed while the button is held. A shorter
+#     one fires on release before the next threshold, crossing it calls feedback. E.g. {2: reboot, 5: shutdown} as in
+#     ShutdownRebootButton.py shuts down after 5 s without waiting for the release.
+#   - press: a press shorter than all hold thresholds. If there is a double action, it fires only after doubleTime
+#     without a second press.
+#   - double: two short presses, the second one within doubleTime after the first release.
+#   - turn: an encoder whose modifier is this button is turned while it is held, value is the number of detents.
+#     The encoder's own action and the hold and press actions of this press are skipped.
+# Usage:
+# encoder = Encoder('volume', 23, 24, volumeAction(VolumeMixer('Master')))
+# button = Button('power', 27, timers, hold={2: reboot, 5: shutdown}, double=printGesture)
+# encoder.modifier = button                         # press-and-turn
+# gpio.watch(pin, device.edge) for every pin in device.pins
+# Devices whose events attribute is an EventBus (see EventBus.py) publish their detents, presses, releases and
+# gestures there as well, for other processes.
+# The actions reboot and shutdown run through power, a PowerAction (see PowerAction.py), add pre-shutdown hooks to it.
+
+from time import monotonic_ns
+from QuadratureDecoder import QuadratureDecoder, FULL_STEP
+from PowerAction import PowerAction
+
+
+# a rotary encoder on the two pins pinA and pinB
+class Encoder:
+    __slots__ = ('name', 'pinA', 'pinB', 'pins', 'A', 'B', 'decoder', 'acceleration', 'action', 'modifier', 'input',
+                 'events', '_lastDetent')
+
+    def __init__(self, name, pinA, pinB, action, resolution=FULL_STEP, acceleration=None, input=None):
+        self.name = name                            # to tell the devices apart, e.g. the section name in the config file
+        self.pinA = pinA                            # channel A, swap pinA and pinB if the direction is inverse
+        self.pinB = pinB                            # channel B
+        self.pins = (pinA, pinB)
+        self.A = 1                                  # current level of channel A
+        self.B = 1                                  # current level of channel B
+        self.decoder = QuadratureDecoder(resolution)
+        self.acceleration = acceleration            # a RotaryAcceleration for bigger steps on fast rotation, or None
+        self.action = action                        # action(encoder, steps) is called for every detent
+        self.modifier = None                        # a Button, while it is held the detents go to its turn action instead
+        self.input = input                          # input(pin) of a backend with snapshots, or None to take the levels of the edges
+        self.events = None                          # an EventBus to publish the detents on, or None
+        self._lastDetent = None                     # timestamp of the last detent, for the rate of the events
+
+    # start decoding from the current levels of the channels
+    def reset(self, A, B):
+        self.A = A
+        self.B = B
+        self.decoder.reset(A, B)
+
+    # process an edge of channel A or B
+    def edge(self, pin, level, timestamp):
+        if self.input is not None:                  # both channels of the same sample
+            self.A = self.input(self.pinA)
+            self.B = self.input(self.pinB)
+        elif pin == self.pinA:
+            self.A = level
+        else:
+            self.B = level
+        detents = self.decoder.update(self.A, self.B)
+        if detents:
+            if self.modifier is not None and self.modifier.turned(detents):
+                return
+            steps = self.acceleration.scale(detents, timestamp) if self.acceleration else detents
+            self.action(self, steps)
+            if self.events is not None:
+                last = self._lastDetent
+                self._lastDetent = timestamp
+                self.events.publish({'time': timestamp, 'device': self.name, 'event': 'detent', 'steps': steps,
+                                     'direction': 1 if detents > 0 else -1, 'position': self.decoder.position,
+                                     'rate': round(abs(detents) * 1e9 / (timestamp - last), 1) if last and timestamp > last else 0})
+
+
+# a push button on pin that grounds the pin when pressed, its gestures are timed by a TimerWheel
+class Button:
+    __slots__ = ('name', 'pin', 'pins', 'timers', 'hold', 'press', 'double', 'turn', 'feedback', 'doubleTime', 'input',
+                 'durations', 'events', 'pressTime', 'presses', 'used', '_longest', '_holdTimers', '_pressTimer')
+
+    def __init__(self, name, pin, timers, hold=None, press=None, double=None, turn=None, feedback=None, doubleTime=0.4,
+                 input=None):
+        self.name = name
+        self.pin = pin
+        self.pins = (pin,)
+        self.timers = timers                        # the TimerWheel, it may be shared by many buttons
+        self.hold = dict(hold or {})                # {seconds: action} for holding the button that long
+        self.press = press                          # action for a short press
+        self.double = double                        # action for two short presses
+        self.turn = turn                            # action for turning an encoder while the button is held
+        self.feedback = feedback                    # called when a hold threshold is crossed that is not the longest
+        self.doubleTime = int(doubleTime * 1e9)     # the second press of a double press must come this soon after the first release
+        self.input = input                          # input(pin) gives the level, so a lost release fires no hold action, GlitchFilter.level if filtered
+        self.durations = None                       # a Metrics.Histogram of the press durations, or None
+        self.events = None                          # an EventBus to publish the presses, releases and gestures on, or None
+        self.pressTime = None                       # time of the press in ns, None while released
+        self.presses = 0                            # number of short presses in a row
+        self.used = False                           # the current press fired its action already
+        self._longest = max(self.hold) if self.hold else None
+        self._holdTimers = []
+        self._pressTimer = None                     # fires the press action if no second press comes
+
+    # process an edge of the button
+    def edge(self, pin, level, timestamp):
+        with self.timers.lock:
+            if self.events is not None:
+                self.events.publish({'time': timestamp, 'device': self.name, 'event': 'up' if level else 'down'})
+            if not level:                           # button falling event
+                self._pressed(timestamp)
+            elif self.pressTime is not None:        # button rising event after a press
+                self._released(timestamp)
+
+    # an encoder has been turned by steps, returns True if the button is held, then this is the press-and-turn gesture
+    def turned(self, steps):
+        with self.timers.lock:
+            if self.pressTime is None:
+                return False
+            self.used = True                        # no hold or press action for this press
+            self._cancelHold()
+            self._fire(self.turn, 'turn', steps)
+            return True
+
+    def _pressed(self, timestamp):
+        if self.pressTime is not None:              # the release got lost, start over with this press
+            self._cancelHold()
+            self.presses = 1
+        elif self._pressTimer is not None:          # the second press of a double press
+            self.timers.cancel(self._pressTimer)
+            self._pressTimer = None
+            self.presses = 2
+        else:
+            self.presses = 1
+        self.pressTime = timestamp
+        self.used = False
+        for seconds in self.hold:                   # fire the hold actions while the button is held
+            self._holdTimers.append(self.timers.schedule(timestamp + int(seconds * 1e9), self._held, seconds))
+
+    # a hold threshold has been crossed
+    def _held(self, seconds):
+        if self.input is not None and self.input(self.pin):     # the button is up, we missed the release
+            self._cancelHold()
+            self.pressTime = None
+            self.presses = 0
+        elif seconds == self._longest:              # nothing can follow, fire right away
+            self.used = True
+            self._cancelHold()
+            self._fire(self.hold[seconds], 'hold', seconds)
+        elif self.feedback:                         # releasing now fires this threshold's action
+            self.feedback(self, 'hold', seconds)
+
+    def _released(self, timestamp):
+        seconds = (timestamp - self.pressTime) / 1e9    # how long the button was pressed
+        self.pressTime = None
+        if self.durations is not None:
+            self.durations.observe(seconds)
+        self._cancelHold()
+        if self.used:                               # fired at the threshold or turned
+            self.presses = 0
+            return
+        reached = [threshold for threshold in self.hold if threshold <= seconds]
+        if reached:                                 # held for the longest threshold reached
+            self.presses = 0
+            self._fire(self.hold[max(reached)], 'hold', seconds)
+        elif self.presses == 2:
+            self.presses = 0
+            self._fire(self.double, 'double', seconds)
+        elif self.double:                           # wait whether a second press follows
+            self._pressTimer = self.timers.schedule(timestamp + self.doubleTime, self._single, seconds)
+        else:
+            self.presses = 0
+            self._fire(self.press, 'press', seconds)
+
+    # no second press came in time
+    def _single(self, seconds):
+        self._pressTimer = None
+        self.presses = 0
+        self._fire(self.press, 'press', seconds)
+
+    def _cancelHold(self):
+        for timer in self._holdTimers:
+            self.timers.cancel(timer)
+        self._holdTimers.clear()
+
+    def _fire(self, action, gesture, value):
+        if self.events is not None:
+            self.events.publish({'time': monotonic_ns(), 'device': self.name, 'event': gesture, 'value': value})
+        if action:
+            action(self, gesture, value)
+
+
+# encoder action that in-/decreases the volume of a VolumeMixer
+def volumeAction(volume):
+    return lambda encoder, steps: volume.change(steps)
+
+
+# encoder action that makes terminal output, as RotaryEncoder.py
+def printDetents(encoder, steps):
+    print('%s %s %d' % (encoder.name, '->' if steps > 0 else '<-', encoder.decoder.position))
+
+
+# button action that makes terminal output, value is the press duration in seconds or the steps turned
+def printGesture(button, gesture, value):
+    print('%s %s %g' % (button.name, gesture, value))
+
+
+power = PowerAction()   # runs the pre-shutdown hooks and then reboot or shutdown, without a shell
+
+
+# button actions as in ShutdownRebootButton.py
+def reboot(button, gesture, value):
+    power.reboot()
+
+
+def shutdown(button, gesture, value):
+    power.shutdown()
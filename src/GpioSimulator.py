@@ -0,0 +1,258 @@
+#!/usr/bin/env python3.5
+
+# This Python module simulates the GPIO pins, so the scripts in this directory can be run and measured without a Pi.
+# A trace is a list of edges (timestamp in ns, pin, level), sorted by timestamp. Traces can be scripted with
+# encoderTrace() and buttonTrace(), made more realistic with addBounce() and addGlitches(), and saved to and loaded from
+# text files with one edge per line ("timestamp pin level"). loadTrace() also reads the binary trace files of
+# EdgeCapture.py.
+# SimulatedBackend has the same interface as the backends in GpioBackend.py and replays a trace into the callbacks,
+# either in the thread that calls run() (like gpiochip) or in a separate thread (threaded=True, like RPi.GPIO). The
+# replay can follow the timestamps in real time (speed=1) or run as fast as possible (speed=0). A TimerWheel passed as
+# timers is advanced in the time of the trace before each edge, so timed gestures fire on time also at speed=0.
+# For the gpiomem backend, createRegister() makes a file that fakes the GPIO block and writeRegister() replays a trace
+# into its level register, e.g. from another process while GpioMemBackend samples it.
+# Usage:
+# trace = addBounce(encoderTrace(100, 5000, 23, 24), pulses=2, width=10000)
+# gpio = SimulatedBackend(trace, speed=1)
+# RotaryEncoder.init(gpio)
+# gpio.run()                                # returns when the trace is replayed
+
+import mmap
+import random
+from threading import Thread
+from time import sleep, monotonic_ns, perf_counter
+from EdgeCapture import isTraceFile, readTrace
+
+
+FORWARD = ((1, 0), (0, 0), (0, 1), (1, 1))     # channel states (A, B) of one -> cycle, starting from rest at 11
+BACKWARD = ((0, 1), (0, 0), (1, 0), (1, 1))    # channel states (A, B) of one <- cycle
+
+
+# the edges of a rotary encoder turned by detents (+ for ->, - for <-) at rate edges per second, starting at rest
+def encoderTrace(detents, rate, pinA=23, pinB=24, start=0):
+    cycle = FORWARD if detents > 0 else BACKWARD
+    trace = []
+    A = B = 1
+    for i in range(abs(detents) * 4):
+        newA, newB = cycle[i % 4]
+        timestamp = start + int((i + 1) * 1e9 / rate)
+        if newA != A:
+            trace.append((timestamp, pinA, newA))
+        else:
+            trace.append((timestamp, pinB, newB))
+        A, B = newA, newB
+    return trace
+
+
+# the edges of a button (pulled up, pressed = 0) that is pressed after idle seconds and held for pressSeconds
+def buttonTrace(pin, pressSeconds, idle=1.0, start=0):
+    pressed = start + int(idle * 1e9)
+    return [(pressed, pin, 0), (pressed + int(pressSeconds * 1e9), pin, 1)]
+
+
+# add contact bounce to the edges of a trace: with the given probability, an edge is followed by pulses short returns
+# to the previous level, each width ns long, before the level is stable
+def addBounce(trace, pulses=3, width=20000, probability=1.0, pins=None, seed=0):
+    generator = random.Random(seed)
+    bounced = []
+    for timestamp, pin, level in trace:
+        bounced.append((timestamp, pin, level))
+        if (pins is None or pin in pins) and generator.random() < probability:
+            for pulse in range(pulses):
+                bounced.append((timestamp + (2 * pulse + 1) * width, pin, 1 - level))
+                bounced.append((timestamp + (2 * pulse + 2) * width, pin, level))
+    bounced.sort()
+    return bounced
+
+
+# add count glitches (pulses of width ns against the current level) at random times on pin
+def addGlitches(trace, pin, count, width=5000, seed=0):
+    generator = random.Random(seed)
+    first, last = trace[0][0], trace[-1][0]
+    glitched = list(trace)
+    for i in range(count):
+        timestamp = generator.randint(first, last)
+        level = 1                                                   # the level of the pin at timestamp, pulled up
+        for edgeTime, edgePin, edgeLevel in trace:
+            if edgeTime > timestamp:
+                break
+            if edgePin == pin:
+                level = edgeLevel
+        glitched.append((timestamp, pin, 1 - level))
+        glitched.append((timestamp + width, pin, level))
+    glitched.sort()
+    return glitched
+
+
+# write a trace to a text file, one edge per line
+def saveTrace(trace, path):
+    with open(path, 'w') as file:
+        for timestamp, pin, level in trace:
+            file.write('%d %d %d\n' % (timestamp, pin, level))
+
+
+# read a trace from a text file, one edge per line, or from a binary trace file written by EdgeCapture.py
+def loadTrace(path):
+    if isTraceFile(path):
+        return readTrace(path)
+    with open(path) as file:
+        return [tuple(int(field) for field in line.split()) for line in file if line.strip()]
+
+
+# make a file that fakes the GPIO block of /dev/gpiomem, all pins high (pulled up)
+def createRegister(path, levels=0xFFFFFFFF, register=0x34):
+    with open(path, 'wb') as file:
+        file.write(bytes(4096))
+    with open(path, 'r+b') as file, mmap.mmap(file.fileno(), 4096) as block:
+        block[register:register + 4] = levels.to_bytes(4, 'little')
+
+
+# write the edges of a trace into the level register (GPLEV0) of a fake GPIO block, at speed like SimulatedBackend,
+# the time between two edges is kept also when the writer was held up, so it never writes several edges at once
+def writeRegister(path, trace, speed=1, register=0x34):
+    with open(path, 'r+b') as file, mmap.mmap(file.fileno(), 4096) as block:
+        words = memoryview(block).cast('I')
+        index = register // 4
+        last = trace[0][0] if trace else 0
+        written = monotonic_ns()
+        for timestamp, pin, level in trace:
+            if speed:
+                delay = (written + (timestamp - last) / speed - monotonic_ns()) / 1e9
+                if delay > 0:
+                    sleep(delay)
+                last = timestamp
+                written = monotonic_ns()
+            if level:
+                words[index] |= 1 << pin
+            else:
+                words[index] &= ~(1 << pin) & 0xFFFFFFFF
+        words.release()
+
+
+# the simulated GPIO backend
+class SimulatedBackend:
+    snapshots = False                           # input() gives the level after the last edge of the pin
+
+    def __init__(self, trace=(), speed=0, threaded=False, levels=None, timers=None):
+        self.trace = trace                      # the edges to replay
+        self.speed = speed                      # 1 replays in real time, 2 twice as fast, etc., 0 as fast as possible
+        self.threadedCallbacks = threaded       # replay in a separate thread, like RPi.GPIO
+        self.levels = dict(levels or {})        # current level of each pin, pins not given here start at 1 (pulled up)
+        self.latencies = []                     # duration of each callback in seconds
+        self.delivered = 0                      # number of edges passed to a callback
+        self.filtered = 0                       # number of edges suppressed by the bouncetime
+        self.timers = timers                    # a TimerWheel to advance in the time of the trace, or None
+        self._callbacks = {}
+        self._bouncetimes = {}
+        self._running = False
+        self._tick = None
+        self._tickInterval = None
+        self._filters = []                      # the GlitchFilters flushed by the replay
+
+    # set up pin as input and call callback(pin, level, timestamp) on both edges
+    def watch(self, pin, callback, bouncetime=0):
+        self._callbacks[pin] = callback
+        self._bouncetimes[pin] = bouncetime * 1000000      # in milliseconds, as in RPi.GPIO
+        self.levels.setdefault(pin, 1)
+
+    def start(self):
+        pass
+
+    # read the current level of a pin
+    def input(self, pin):
+        return self.levels.get(pin, 1)
+
+    # call callback() about every interval seconds (real time) during the replay, between the edges
+    def tick(self, callback, interval):
+        self._tick = callback
+        self._tickInterval = interval
+
+    # pass on the pending levels of a GlitchFilter from the replay when they are due in the time of the trace, like the
+    # gpiochip loop, or start its flusher thread if the replay runs in a thread of its own, like RPi.GPIO
+    def addFilter(self, glitchFilter):
+        if self.threadedCallbacks:
+            glitchFilter.start()
+        else:
+            glitchFilter.start(thread=False)
+            self._filters.append(glitchFilter)
+
+    # replay the trace and return when it is done or stop() is called
+    def run(self):
+        self._running = True
+        if self.threadedCallbacks:
+            thread = Thread(target=self._replay, name='SimulatedBackend')
+            thread.start()
+            thread.join(self._tickInterval)
+            while thread.is_alive():            # like RPi.GPIO, run() only idles and ticks
+                self._tick()
+                thread.join(self._tickInterval)
+        else:
+            self._replay()
+
+    def stop(self):
+        self._running = False
+
+    def cleanup(self):
+        pass
+
+    # pass the edges of the trace to the callbacks, timestamps are moved to the monotonic clock of the replay
+    def _replay(self):
+        if not self.trace:
+            return
+        callbacks = self._callbacks
+        bouncetimes = self._bouncetimes
+        levels = self.levels
+        latencies = self.latencies
+        lastEdges = {}
+        first = self.trace[0][0]
+        start = monotonic_ns()
+        tick = None if self.threadedCallbacks else self._tick
+        filters = self._filters
+        if tick is not None:
+            tickInterval = int(self._tickInterval * 1e9)
+            nextTick = start + tickInterval
+        for timestamp, pin, level in self.trace:
+            if not self._running:
+                break
+            timestamp = start + timestamp - first
+            due = start + (timestamp - start) / self.speed if self.speed else 0
+            while True:
+                now = monotonic_ns()
+                if tick is not None and now >= nextTick:
+                    tick()                      # between the edges and while waiting for them, like the gpiochip loop
+                    nextTick = now + tickInterval
+                wakeup = due if tick is None else min(due, nextTick)
+                flushTime = min(start + (now - start) * self.speed, timestamp - 1) if self.speed else timestamp - 1
+                for glitchFilter in filters:    # pass on the levels that became stable, in the time of the trace
+                    pending = glitchFilter.due()
+                    if pending is not None and pending <= flushTime:
+                        glitchFilter.flush(flushTime)
+                        pending = glitchFilter.due()
+                    if pending is not None and self.speed:
+                        wakeup = min(wakeup, start + (pending - start) / self.speed)
+                if now >= due:
+                    break
+                sleep(max(0, wakeup - now) / 1e9)
+            if self.timers is not None:         # fire the timers that are due before this edge
+                self.timers.advance(timestamp - 1)
+            levels[pin] = level
+            callback = callbacks.get(pin)
+            if callback is None:
+                continue
+            if timestamp - lastEdges.get(pin, -bouncetimes[pin]) < bouncetimes[pin]:
+                self.filtered += 1
+                continue
+            lastEdges[pin] = timestamp
+            self.delivered += 1
+            callStart = perf_counter()
+            callback(pin, level, timestamp)
+            latencies.append(perf_counter() - callStart)
+        for glitchFilter in filters:            # the levels that become stable after the last edge
+            pending = glitchFilter.due()
+            while pending is not None and self._running:
+                if self.speed:
+                    sleep(max(0, start + (pending - start) / self.speed - monotonic_ns()) / 1e9)
+                glitchFilter.flush(pending)
+                pending = glitchFilter.due()
+        if self.timers is not None and self._running:
+            self.timers.advance(timestamp)      # and those due at the end of the trace
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3.5
+
+# This Python module counts and times what the scripts do, so their behavior under load can be monitored, e.g. edges
+# per second, invalid transitions, how long edges wait for the decoder, mixer write latency and press durations.
+# Latencies and durations go into histograms with fixed buckets: observing a value is one bisect and two additions,
+# nothing grows. Counters that the objects keep anyway (e.g. QuadratureDecoder.invalid, EdgeQueue.dropped) are not
+# counted twice, they are read by a collector function only when the metrics are exported.
+# The metrics are exported in the Prometheus text format, to a text file (e.g. for the textfile collector of the node
+# exporter, rewritten every interval) and/or on a Unix socket (every connection gets the current metrics, e.g.
+# socat - UNIX-CONNECT:/run/GpioDaemon.metrics). The histograms of a pin are registered on its first edge, maybe while
+# an export thread renders, so registering and the copy that render() formats are done under one lock. The histograms
+# are updated without a lock, from the thread that processes the edges, so an increment may get lost in the rare case
+# that two threads observe the same one at once.
+# To switch the metrics off, the scripts keep None instead of a Metrics object and do not wrap their callbacks, so
+# nothing is left on the hot path.
+# Usage:
+# metrics = Metrics()
+# callback = metrics.wrapEdges(callback)                    # edge delay and callback duration per pin
+# metrics.collect('gpio_edges_dropped_total', 'Edges pushed out of the full queue.', lambda: edges.dropped)
+# mixer.latency = metrics.histogram('mixer_write_seconds', 'Duration of the mixer writes.')
+# metrics.start('/var/lib/node_exporter/textfile_collector/GpioDaemon.prom', '/run/GpioDaemon.metrics', 15)
+# metrics.close()
+
+import os
+import socket
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+from time import monotonic_ns
+
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 10)     # e.g. press durations in seconds
+
+
+# a histogram with fixed bucket bounds, the values are in seconds
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)                 # upper bounds of the buckets, ascending
+        self.counts = [0] * (len(self.bounds) + 1)  # number of values per bucket, the last one is above all bounds
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    def __init__(self):
+        self.families = {}                          # name: (type, help, {labels: Histogram or collector function})
+        self._edgeHistograms = {}                   # pin: (delay Histogram, duration Histogram)
+        self._lock = Lock()                         # held to change families and to copy them for render()
+        self._closed = Event()
+        self._threads = []
+        self._server = None
+        self._socketPath = None
+
+    # register a histogram, returns it for observe()
+    def histogram(self, name, help, bounds=LATENCY_BUCKETS, **labels):
+        histogram = Histogram(bounds)
+        self._add(name, 'histogram', help, labels, histogram)
+        return histogram
+
+    # register a counter or gauge whose value function() returns when the metrics are exported
+    def collect(self, name, help, function, kind='counter', **labels):
+        self._add(name, kind, help, labels, function)
+
+    def _add(self, name, kind, help, labels, source):
+        with self._lock:
+            family = self.families.setdefault(name, (kind, help, {}))
+            if family[0] != kind:
+                raise ValueError('metric %s is a %s, not a %s' % (name, family[0], kind))
+            family[2][tuple(sorted((key, str(value)) for key, value in labels.items()))] = source
+
+    # wrap an edge callback(pin, level, timestamp), so the time from the edge to the callback and the duration of the
+    # callback are observed per pin, the number of edges is the count of these histograms
+    def wrapEdges(self, callback):
+        histograms = self._edgeHistograms
+
+        def timed(pin, level, timestamp):
+            start = monotonic_ns()
+            callback(pin, level, timestamp)
+            end = monotonic_ns()
+            try:
+                delay, duration = histograms[pin]
+            except KeyError:
+                delay, duration = histograms[pin] = (
+                    self.histogram('gpio_edge_delay_seconds', 'Time from the edge to its processing.', pin=pin),
+                    self.histogram('gpio_callback_seconds', 'Duration of the processing of an edge.', pin=pin))
+            delay.observe((start - timestamp) / 1e9)
+            duration.observe((end - start) / 1e9)
+        return timed
+
+    # the metrics in the Prometheus text format
+    def render(self):
+        with self._lock:                            # a snapshot, the edge thread may register a pin meanwhile
+            families = [(name, kind, help, sorted(series.items()))
+                        for name, (kind, help, series) in sorted(self.families.items())]
+        lines = []
+        for name, kind, help, series in families:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, source in series:
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(source.bounds + ('+Inf',), source.counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (name, formatLabels(labels + (('le', str(bound)),)), cumulative))
+                    lines.append('%s_sum%s %r' % (name, formatLabels(labels), source.sum))
+                    lines.append('%s_count%s %d' % (name, formatLabels(labels), cumulative))
+                else:
+                    lines.append('%s%s %r' % (name, formatLabels(labels), source()))
+        return '\n'.join(lines) + '\n'
+
+    # write the metrics to a text file, it is replaced at once, so a reader never sees half of it
+    def writeTextfile(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+    # export the metrics to path every interval seconds and/or on the Unix socket socketPath, each in a thread
+    def start(self, path=None, socketPath=None, interval=15.0):
+        if path:
+            self._threads.append(Thread(target=self._writeEvery, args=(path, interval), name='MetricsFile', daemon=True))
+        if socketPath:
+            if os.path.exists(socketPath):
+                os.remove(socketPath)               # left behind by an earlier run
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(socketPath)
+            self._server.listen(4)
+            self._socketPath = socketPath
+            self._threads.append(Thread(target=self._serve, name='MetricsSocket', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    # stop exporting, the text file is written a last time
+    def close(self):
+        self._closed.set()
+        if self._server is not None:
+            self._server.shutdown(socket.SHUT_RDWR)  # wakes accept()
+            self._server.close()
+            os.remove(self._socketPath)
+        for thread in self._threads:
+            thread.join()
+
+    def _writeEvery(self, path, interval):
+        while True:
+            self.writeTextfile(path)
+            if self._closed.wait(interval):
+                self.writeTextfile(path)
+                return
+
+    def _serve(self):
+        while not self._closed.is_set():
+            try:
+                connection, address = self._server.accept()
+            except OSError:                         # closed
+                return
+            with connection:
+                try:
+                    connection.sendall(self.render().encode())
+                except OSError:                     # the client is gone already
+                    pass
+
+
+# labels as {key="value",...}, or nothing if there are none
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
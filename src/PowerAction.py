@@ -0,0 +1,138 @@
+#!/usr/bin/env python3.5
+
+# This Python module runs the reboot and shutdown of the button scripts on a fast and predictable path.
+# The command is executed directly, without a shell in between. Before, the registered pre-shutdown hooks flush the
+# state of other programs: they are started all at once and run in parallel, each for at most its timeout, and all
+# together for at most deadline seconds after the action was triggered. Hooks that take longer are killed (commands)
+# or left behind (Python callables), so a hanging hook cannot keep the Pi from powering off. A sync of the file systems
+# is started right away as well, alongside the hooks, so the command itself finds little left to write.
+# Each phase is timed and logged (default: print to stderr) and kept in phases, e.g. for a benchmark. The commands
+# can be replaced by stub commands, e.g. ('true',), to test the whole path without powering off.
+# Only the first action is carried out, later ones are ignored, e.g. a shutdown after a reboot has been triggered.
+# Usage:
+# power = PowerAction(hookTimeout=2, deadline=4)
+# power.addHook(('systemctl', 'stop', 'mpd'))   # a command, argument list without shell
+# power.addHook(volume.close, 1)                # or a Python callable, with a timeout of its own
+# power.reboot()                                # returns right away, the action runs in a thread of its own
+
+import os
+import sys
+from threading import Thread
+from time import monotonic
+
+
+REBOOT = ('reboot',)
+SHUTDOWN = ('shutdown', '-h', 'now', 'System shutdown by GPIO action')
+
+
+# prepend sudo to a command unless we are root already (e.g. started from rc.local)
+def asRoot(command):
+    return tuple(command) if os.geteuid() == 0 else ('sudo', '-n') + tuple(command)
+
+
+class PowerAction:
+    def __init__(self, hookTimeout=2.0, deadline=4.0, rebootCommand=None, shutdownCommand=None, log=None):
+        self.hookTimeout = hookTimeout              # default time in seconds a hook may take
+        self.deadline = deadline                    # the hooks and the sync may take this long all together
+        self.rebootCommand = rebootCommand or asRoot(REBOOT)        # the commands, an argument list each
+        self.shutdownCommand = shutdownCommand or asRoot(SHUTDOWN)
+        self.log = log or (lambda message: print(message, file=sys.stderr, flush=True))
+        self.hooks = []                             # (hook, timeout), a hook is an argument list or a callable
+        self.phases = []                            # (phase, seconds, result) of the last action
+        self.started = False                        # an action has been triggered, later ones are ignored
+        self._thread = None
+
+    # register a pre-shutdown hook, a command (argument list) or a Python callable, timeout None for hookTimeout
+    def addHook(self, hook, timeout=None):
+        self.hooks.append((hook, self.hookTimeout if timeout is None else timeout))
+
+    def reboot(self):
+        return self.start(self.rebootCommand)
+
+    def shutdown(self):
+        return self.start(self.shutdownCommand)
+
+    # run the hooks and then command in a thread, so the caller (e.g. the timer thread) is not blocked
+    def start(self, command):
+        if self.started:
+            return None
+        self.started = True
+        self._thread = Thread(target=self.execute, args=(command,), name='PowerAction')
+        self._thread.start()
+        return self._thread
+
+    # wait for the action to finish, e.g. before a test checks phases
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # run the sync and the hooks in parallel, then exec command, returns its process
+    def execute(self, command):
+        from subprocess import Popen                # imported only now, it slows down the start of the scripts
+        start = monotonic()
+        end = start + self.deadline
+        self.phases = []
+        syncer = Thread(target=os.sync, name='PowerActionSync', daemon=True)
+        syncer.start()                              # sync early, it runs while the hooks flush
+
+        running = []                                # (name, thread, process or None, end of its timeout)
+        finished = {}                               # index of the hook: (time it finished, result)
+        for index, (hook, timeout) in enumerate(self.hooks):
+            process = None
+            if callable(hook):
+                name = getattr(hook, '__name__', repr(hook))
+                worker = Thread(target=self._call, args=(hook, index, finished), name='PowerActionHook', daemon=True)
+            else:
+                name = ' '.join(hook)
+                try:
+                    process = Popen(hook, close_fds=True)
+                except OSError as error:
+                    self._phase(name, start, 'failed: %s' % error)
+                    continue
+                worker = Thread(target=self._wait, args=(process, index, finished), name='PowerActionHook', daemon=True)
+            worker.start()
+            running.append((index, name, worker, process, min(start + timeout, end)))
+        running.sort(key=lambda hook: hook[4])
+        for index, name, worker, process, hookEnd in running:  # they run in parallel, so wait for each until its own end
+            worker.join(max(0, hookEnd - monotonic()))
+            if index in finished:
+                self._phase(name, start, finished[index][1], finished[index][0])
+            elif process is not None:
+                process.kill()
+                self._phase(name, start, 'timeout, killed')
+            else:
+                self._phase(name, start, 'timeout, left behind')
+        syncer.join(max(0, end - monotonic()))
+        self._phase('sync', start, 'running' if syncer.is_alive() else 'done')
+
+        execStart = monotonic()
+        try:
+            process = Popen(command, close_fds=True)    # no shell, the command is executed directly
+        except OSError as error:
+            process = None
+            self._phase('exec ' + ' '.join(command), execStart, 'failed: %s' % error)
+        else:
+            self._phase('exec ' + ' '.join(command), execStart, 'pid %d' % process.pid)
+        self.phases.append(('total', monotonic() - start, ''))
+        self.log('power: total %.1f ms' % ((monotonic() - start) * 1000))
+        return process
+
+    # run a callable hook in its thread
+    def _call(self, hook, index, finished):
+        try:
+            hook()
+            result = 'done'
+        except Exception as error:
+            result = 'failed: %s' % error
+        finished[index] = monotonic(), result
+
+    # wait for a command hook in its thread
+    def _wait(self, process, index, finished):
+        result = 'exit %d' % process.wait()
+        finished[index] = monotonic(), result
+
+    # time and log a phase that ran from start until end (default now)
+    def _phase(self, name, start, result, end=None):
+        seconds = (end or monotonic()) - start
+        self.phases.append((name, seconds, result))
+        self.log('power: %s %.1f ms, %s' % (name, seconds * 1000, result))
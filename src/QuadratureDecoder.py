@@ -0,0 +1,85 @@
+#!/usr/bin/env python3.5
+
+# This Python module decodes the two channels of a rotary encoder into detents.
+# It replaces the aDown/bUp/bDown flags of the original scripts by a precomputed transition table that is indexed by
+# the previous and the current state of the channels A and B. Transitions where both channels changed at once (one
+# edge was missed, typically on fast rotation) are counted and bridged in the last known rotation direction instead of
+# being silently lost.
+# Usage:
+# decoder = QuadratureDecoder(FULL_STEP)
+# detents = decoder.update(A, B)  # call this on every edge of channel A or B, it returns the number of detents (+ for ->, - for <-)
+
+# Rotary encoder pulse
+#         +-------+       +-------+   0
+#  A      |       |       |       |
+#   ------+       +-------+       +-- 1
+#     +-------+       +-------+       0
+#  B  |       |       |       |
+#   --+       +-------+       +------ 1
+#
+# The state is encoded as A << 1 | B. Turning -> runs through the Gray code 11 -> 10 -> 00 -> 01 -> 11.
+
+
+FULL_STEP = 4       # one detent per full Gray code cycle (4 transitions), this is what most mechanical encoders have
+HALF_STEP = 2       # one detent per half cycle (at states 11 and 00)
+QUARTER_STEP = 1    # one detent per transition
+INVALID = 2         # marks a transition in which both channels changed
+
+# transition table, index is previous state << 2 | current state, value is +1 (->), -1 (<-), 0 (no change) or INVALID
+TRANSITIONS = (
+    0,       +1,      -1,      INVALID,     # previous state 00
+    -1,      0,       INVALID, +1,          # previous state 01
+    +1,      INVALID, 0,       -1,          # previous state 10
+    INVALID, -1,      +1,      0)           # previous state 11
+
+# the states at which a detent is completed, indexed by resolution and state
+DETENT_STATES = {
+    FULL_STEP: (False, False, False, True),
+    HALF_STEP: (True, False, False, True),
+    QUARTER_STEP: (True, True, True, True)}
+
+
+class QuadratureDecoder:
+    __slots__ = ('resolution', 'state', 'steps', 'direction', 'position', 'invalid', '_detentStates')
+
+    def __init__(self, resolution=FULL_STEP, A=1, B=1):
+        if resolution not in DETENT_STATES:
+            raise ValueError('resolution must be FULL_STEP, HALF_STEP or QUARTER_STEP')
+        self.resolution = resolution                        # number of transitions per detent
+        self._detentStates = DETENT_STATES[resolution]      # lookup of the states that complete a detent
+        self.position = 0                                   # sum of all detents decoded so far
+        self.invalid = 0                                    # number of transitions in which both channels changed
+        self.reset(A, B)
+
+    # set the current channel states, e.g. after reading them at initialization
+    def reset(self, A, B):
+        self.state = A << 1 | B     # current state of the channels
+        self.steps = 0              # transitions accumulated since the last detent state
+        self.direction = 0          # direction of the last valid transition, used to bridge invalid ones
+
+    # process the current channel states and return the number of completed detents (+ for ->, - for <-)
+    def update(self, A, B):
+        state = A << 1 | B
+        transition = TRANSITIONS[self.state << 2 | state]
+        if not transition:                          # nothing changed, e.g. an edge and its bounce read the same state
+            return 0
+        self.state = state
+
+        if transition == INVALID:                   # we missed an edge, hence we skipped one state
+            self.invalid += 1                       # count it
+            self.steps += self.direction << 1       # and assume that we moved on in the last known direction
+        else:
+            self.steps += transition
+            self.direction = transition
+
+        if not self._detentStates[state]:           # detent not yet completed
+            return 0
+
+        steps = self.steps
+        self.steps = 0
+        if steps > 0:
+            detents = (steps + (self.resolution >> 1)) // self.resolution      # round to the nearest number of detents
+        else:
+            detents = -((-steps + (self.resolution >> 1)) // self.resolution)
+        self.position += detents
+        return detents
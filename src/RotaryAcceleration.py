@@ -0,0 +1,44 @@
+#!/usr/bin/env python3.5
+
+# This Python module makes a rotary encoder velocity-sensitive.
+# It estimates the rotation rate (detents per second) from the timestamps of the last few detents and scales the
+# detents accordingly. Up to slowRate the detents are passed through unchanged, so slow turns keep their precision.
+# Beyond that, every detent counts (rate / slowRate) ** exponent times, but not more than cap times. Changing the
+# direction or pausing (no detent for longer than 1 / slowRate seconds) starts over with single steps.
+# Usage:
+# acceleration = RotaryAcceleration()
+# steps = acceleration.scale(detents, timestamp)    # timestamp of the detent in nanoseconds, e.g. from monotonic_ns()
+
+from collections import deque
+
+
+class RotaryAcceleration:
+    __slots__ = ('slowRate', 'exponent', 'cap', '_times', '_direction')
+
+    def __init__(self, window=4, slowRate=10.0, exponent=2.0, cap=20):
+        self.slowRate = slowRate                # detents per second up to which there is no acceleration
+        self.exponent = exponent                # shape of the acceleration curve, 1 is linear
+        self.cap = cap                          # maximum number of steps per detent
+        self._times = deque(maxlen=window)      # timestamps of the last detents, the rate is estimated over them
+        self._direction = 0                     # direction of the last detents
+
+    # return the number of steps for the given detents (+ for ->, - for <-) that happened at timestamp (in ns)
+    def scale(self, detents, timestamp):
+        direction = 1 if detents > 0 else -1
+        times = self._times
+        if direction != self._direction:        # start over when the direction changes
+            times.clear()
+            self._direction = direction
+        elif times and timestamp - times[-1] > 1e9 / self.slowRate:   # or after a pause, slower than slowRate
+            times.clear()
+        times.append(timestamp)
+        if len(times) < 2:
+            return detents
+
+        span = times[-1] - times[0]             # time in ns over which the detents in the window happened
+        if span <= 0:
+            return detents * self.cap
+        rate = (len(times) - 1) * 1e9 / span    # detents per second
+        if rate <= self.slowRate:
+            return detents
+        return detents * min(self.cap, int((rate / self.slowRate) ** self.exponent))
@@ -1,48 +1,89 @@
 #!/usr/bin/env python3.5
 
 # This Python script drives a shutdown/reboot button on GPIO pin 13, GND on pin 14.
-# Put it to a location on your Pi, say /home/pi/myTools/ and add the following line
-# to /etc/rc.local before exit 0:
+# Put it to a location on your Pi, say /home/pi/myTools/ and install it as systemd service like GpioDaemon.service, or
+# add the following line to /etc/rc.local before exit 0:
 # python /home/pi/myTools/ShutdownRebootButton.py&
+# It requires GpioBackend.py, GpioDevices.py, QuadratureDecoder.py, TimerWheel.py, GlitchFilter.py, PowerAction.py,
+# Systemd.py and EdgeCapture.py in the same directory. kill -USR1 PID writes the last edges to captureFile.
+# GlitchFilter removes the bounce and glitches of the button, TraceAnalyzer.py recommends its minPulse from such a
+# captured trace.
+# Releasing the button after 2 up to 5 seconds reboots. Holding it for 5 seconds shuts down right away, the release is
+# not awaited. The timing runs on a TimerWheel, see GpioDevices.Button for more gestures.
+# Add the commands that flush the state of your programs before power-off to preShutdownHooks, they run in parallel.
+# With metricsFile or metricsSocket set, Metrics.py (in the same directory) exports the press durations for Prometheus.
 
 # author: Axel Berndt
 
-from time import sleep, time
-from subprocess import call
-from RPi import GPIO
+from GpioBackend import openBackend
+from EdgeCapture import EdgeCapture
+from GlitchFilter import GlitchFilter
+from GpioDevices import Button
+from TimerWheel import TimerWheel
+from PowerAction import PowerAction
+import Systemd
 
+GPIObackend = 'RPi.GPIO'  # set 'gpiochip' to read the pin via the Linux GPIO character device (one thread, kernel timestamps)
 GPIOpin = 27    # Button is on GPIO channel 27 / pin 13 of 40way connector with GND on pin 14
-pressTime = float('Inf')  # this is used to keep track of the time passing between button press and release, when waiting for button press/falling it has the positive inf value to prevent unintended shutdowns
-
-def init():
-    GPIO.setmode(GPIO.BCM)                                  # set the GPIO naming/numbering convention to BCM
-    GPIO.setup(GPIOpin, GPIO.IN, pull_up_down=GPIO.PUD_UP)  # setup the channel as input with a 50K Ohm pull up. A push button will ground the pin, creating a falling edge.
-    GPIO.add_event_detect(GPIOpin, GPIO.BOTH, callback=buttonPress)#, bouncetime=100) # define interrupt, add the bouncetime if it works better with your button
-
-# the callback function when button is pressed/released
-def buttonPress(GPIOpin):
-    global pressTime                            # get access to the global time variable
-    if not GPIO.input(GPIOpin):                 # if button falling event
-        if pressTime != float('Inf'):           # if button is already pressed due to missing rise event or bouncing
-            return                              # keep the current pressTime value, done
-        pressTime = time()                      # get the current time
-    else:                                       # if button rising event
-        timePassed = time() - pressTime         # compute how long the button was pressed
-        if timePassed < 2:                      # if it is less than 2 seconds
-            pressTime = float('Inf')            # waiting for next button falling, prevent unintended reboot/shutdowns by setting this variable to positive infinity
-        elif timePassed < 5:                    # if pressed for 2 up to 5 seconds
-            call(['sudo reboot &'], shell=True) # do reboot
-        else:                                   # if pressed for 5 seconds and more
-            call(['shutdown -h now "System shutdown by GPIO action" &'], shell=True)   # do shutdown
+timers = TimerWheel(0.01)   # times the button and the glitch filter in one thread, 10 ms resolution
+glitchFilter = GlitchFilter(0.01, timers=timers)  # passes a button level on only after it was stable for 10 ms, set None to switch the filter off
+button = None   # the Button, it is set up in init()
+preShutdownHooks = []   # commands run in parallel before reboot and shutdown, e.g. [('systemctl', 'stop', 'mpd')]
+power = PowerAction(hookTimeout=2, deadline=4)    # each hook may take 2 s, all of them together 4 s
+capture = EdgeCapture(4096)   # keeps the last 4096 edges for analysis, set None to switch the capture off
+captureFile = '/tmp/ShutdownRebootButton.trace'  # kill -USR1 PID writes the captured edges to this file
+metricsFile = None      # e.g. '/var/lib/node_exporter/textfile_collector/ShutdownRebootButton.prom' to export metrics for Prometheus
+metricsSocket = None    # or a Unix socket path that serves them, both None switch the metrics off
+metrics = None  # the Metrics, if switched on, set up in init()
+gpio = None     # the GPIO backend, it is opened in init()
+
+# initialize GPIO input and define interrupts, a backend can be passed in, e.g. a SimulatedBackend
+def init(backend=None):
+    global gpio, button, metrics                    # get access to the global backend, button and metrics variables
+    gpio = backend or openBackend(GPIObackend)      # open the GPIO backend
+    for hook in preShutdownHooks:
+        power.addHook(hook)
+    button = Button('power', GPIOpin, timers, hold={2: reboot, 5: shutdown},     # checks the filtered level before a hold action
+                    input=glitchFilter.level if glitchFilter else gpio.input)
+    callback = button.edge
+    if glitchFilter:                                # remove bounce and glitches
+        callback = glitchFilter.wrap(callback)
+        gpio.addFilter(glitchFilter)                # it runs on the timers, or it is flushed by the backend
+    if metricsFile or metricsSocket:                # time the edges and record the press durations
+        from Metrics import Metrics, DURATION_BUCKETS
+        metrics = Metrics()
+        button.durations = metrics.histogram('button_press_seconds', 'Durations of the button presses.', DURATION_BUCKETS)
+        callback = metrics.wrapEdges(callback)
+        metrics.start(metricsFile, metricsSocket)
+    if capture:                                     # record every edge before it is processed
+        callback = capture.wrap(callback)
+        capture.dumpOnSignal(captureFile)
+    gpio.watch(GPIOpin, callback)                   # setup the channel as input with a 50K Ohm pull up and react on both edges. A push button will ground the pin, creating a falling edge. Its bounce is removed by glitchFilter
+    gpio.start()                                    # start edge detection
+    timers.start()                                  # start the timer thread
+
+# the action when the button is released after 2 up to 5 seconds
+def reboot(button, gesture, seconds):
+    power.reboot()                                  # do reboot, after the hooks
+
+# the action when the button is held for 5 seconds
+def shutdown(button, gesture, seconds):
+    power.shutdown()                                # do shutdown, after the hooks
 
 def main():
     try:                        # run the program
         init()                  # initialize everything
-        while True:             # idle loop
-            sleep(60)           # wakes up once every minute
-    except KeyboardInterrupt:
-        GPIO.cleanup()          # clean up GPIO on CTRL+C exit
-    GPIO.cleanup()              # clean up GPIO on normal exit
+        Systemd.ready(gpio)     # edge detection is armed, tell systemd if it started us
+        gpio.run()              # dispatch the GPIO events (gpiochip) or idle (RPi.GPIO), ping the systemd watchdog
+    except KeyboardInterrupt:   # CTRL+C exit
+        pass
+    Systemd.notify('STOPPING=1')
+    gpio.cleanup()              # clean up GPIO
+    if glitchFilter:
+        glitchFilter.close()    # stop the flusher thread
+    timers.close()              # stop the timer thread
+    if metrics:
+        metrics.close()         # write the metrics file a last time
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,104 +1,63 @@
 #!/usr/bin/env python3.5
 
 # This is a combination of ShutdownRebootButton.py and VolumeRotaryControl.py. It is handy for those who use a rotary switch.
+# The encoder and the button are devices of GpioDaemon.py, set up from the global variables below instead of a config
+# file, so everything runs in one process with one dispatcher. It requires GpioDaemon.py and the modules it requires
+# in the same directory. kill -USR1 PID writes the last edges to captureFile. GlitchFilter removes the bounce and
+# glitches of the encoder and the button, TraceAnalyzer.py recommends their minPulse from a captured trace.
+# With eventSocket set, the detents and gestures are published there for other processes, see EventBus.py.
 
 # Author: Axel Berndt
 
 
-from RPi import GPIO
-from time import sleep, time
-from subprocess import call
-import alsaaudio
+import GpioDaemon
+import GpioDevices
+from GpioDevices import Encoder, Button, volumeAction, reboot, shutdown
+from EdgeCapture import EdgeCapture
+from QuadratureDecoder import FULL_STEP
+from RotaryAcceleration import RotaryAcceleration
 
 
+GPIObackend = 'RPi.GPIO'    # set 'gpiochip' to read the pins via the Linux GPIO character device (one thread, kernel timestamps)
 GPIOpinButton = 27          # Button is on GPIO channel 27 / pin 13 of 40way connector with GND on pin 14
 GPIOpinA = 23               # left pin of the rotary encoder is on GPIO 23 (Pi pin 16)
 GPIOpinB = 24               # right pin of the rotary encoder is on GPIO 24 (Pi pin 18)
-aDown = False               # this is set True to wait for GPIO A to go down
-bUp = False                 # this is set True to wait for GPIO B to go up
-bDown = False               # this is set True to wait for GPIO B to go down
-pressTime = float('Inf')    # this is used to keep track of the time passing between button press and release, when waiting for button press/falling it has the positive inf value to prevent unintended shutdowns
-
-
-# initialize GPIO input and define interrupts
-def init():
-    GPIO.setmode(GPIO.BCM)                                                  # set the GPIO naming/numbering convention to BCM
-    GPIO.setup(GPIOpinA, GPIO.IN, pull_up_down=GPIO.PUD_UP)                 # input channel A
-    GPIO.setup(GPIOpinB, GPIO.IN, pull_up_down=GPIO.PUD_UP)                 # input channel B
-    GPIO.setup(GPIOpinButton, GPIO.IN, pull_up_down=GPIO.PUD_UP)            # setup the channel as input with a 50K Ohm pull up. A push button will ground the pin, creating a falling edge.
-    GPIO.add_event_detect(GPIOpinA, GPIO.BOTH, callback=rotaryInterruptA)   # define interrupt for action on channel A (no bouncetime needed)
-    GPIO.add_event_detect(GPIOpinB, GPIO.BOTH, callback=rotaryInterruptB)   # define interrupt for action on channel B (no bouncetime needed)
-    GPIO.add_event_detect(GPIOpinButton, GPIO.BOTH, callback=buttonInterrupt)#, bouncetime=100) # define interrupt, add the bouncetime if it works better with your button
-
-
-# the callback functions when turning the encoder
-# this one reacts on action on channel A
-def rotaryInterruptA(GPIOpin):
-    A = GPIO.input(GPIOpinA)                # read current value of channel A
-    B = GPIO.input(GPIOpinB)                # read current value of channel B
-
-    global aDown, bUp, bDown                # get access to some more global variables
-    if aDown:                               # if we are waiting for channel A to go down (to finish -> rotation cycle)
-        if not A:                           # check if it is down now
-            aDown = False                   # -> rotation cycle finished
-    elif bUp or bDown:                      # if a <- rotation cycle is unfinished so far
-        pass                                # don't do anything new
-    elif A:                                 # if a new rotation cycle starts, i.e. nothing to go up or down
-        mixer = alsaaudio.Mixer()           # get ALSA mixer channel 'Master'
-        volume = int(mixer.getvolume()[0])  # get the left channel's volume gain (right channel is the same)
-        if B:                               # if B is already up, the rotation direction is ->
-            aDown = True                    # to finish the cycle, wait for A to go down again
-            if volume < 100:                # do not get greater than 100 (ALSA max)
-                volume += 1                 # increase volume gain
-        else:                               # if B still has to come up, the rotation direction is <-
-            bUp = True                      # in this rotation cycle B has to come up and down again, we start with waiting for B to come up
-            if volume < 0:                  # do not get below 0 (ALSA min)
-                volume -= 1                 # decrease volume gain
-        mixer.setvolume(volume)             # apply the new volume gain to the mixer channel
-    return                                  # done
-
-
-# this callback function reacts on action on channel B
-def rotaryInterruptB(GPIOpin):
-    B = GPIO.input(GPIOpin) # read current value of channel B
-
-    global bUp, bDown       # get access to some more global variables
-    if B:                   # if B is up
-        if bUp:             # and we have been waiting for B to come up (this is part of the <- rotation cycle)
-            bDown = True    # wait for B to come down again
-            bUp = False     # done with this
-    elif bDown:             # B is down (if B: was False) and if we were waiting for B to come down
-        bDown = False       # <- rotation cycle finished
-    return                  # done
-
-
-# the callback function when button is pressed/released
-def buttonInterrupt(GPIOpin):
-    global pressTime                            # get access to the global time variable
-    if not GPIO.input(GPIOpin):                 # if button falling event
-        pressTime = time()                      # get the current time
-        if pressTime != float('Inf'):           # if button is already pressed due to missing rise event or bouncing
-            return                              # keep the current pressTime value, done
-    else:                                       # if button rising event
-        timePassed = time() - pressTime         # compute how long the button was pressed
-        if timePassed < 2:                      # if it is less than 2 seconds
-            pressTime = float('Inf')            # waiting for next button falling, prevent unintended reboot/shutdowns by setting this variable to positive infinity
-        elif timePassed < 5:                    # if pressed for 2 up to 5 seconds
-            call(['sudo reboot &'], shell=True) # do reboot
-        else:                                   # if pressed for 5 seconds and more
-            call(['shutdown -h now "System shutdown by GPIO action" &'], shell=True)   # do shutdown
+resolution = FULL_STEP      # use HALF_STEP or QUARTER_STEP if your encoder has more detents per cycle
+rotaryMinPulse = 0.00002    # a channel level is passed on only after it was stable for 20 us, set 0 to switch the glitch filter off
+buttonMinPulse = 0.01       # a button level is passed on only after it was stable for 10 ms, set 0 to switch the glitch filter off
+preShutdownHooks = []       # commands run in parallel before reboot and shutdown, e.g. [('systemctl', 'stop', 'mpd')]
+buttonActions = {2: reboot, 5: shutdown}    # reboot when released after 2 up to 5 seconds, shutdown as soon as pressed for 5 seconds
+mixerControl = 'Master'     # the ALSA mixer channel, e.g. 'Digital' for the IQaudIO Pi-DAC+ card
+mixerInterval = 0.005       # write the mixer at most once every 5 ms, detents in between are added up
+acceleration = RotaryAcceleration(window=4, slowRate=10, exponent=2, cap=20)   # bigger volume steps on fast rotation, set None for fixed 1 % steps
+capture = EdgeCapture(65536)    # keeps the last 65536 edges for analysis, set None to switch the capture off
+captureFile = '/tmp/ShutdownRebootVolumeControl.trace'  # kill -USR1 PID writes the captured edges to this file
+metricsFile = None          # e.g. '/var/lib/node_exporter/textfile_collector/ShutdownRebootVolumeControl.prom' to export metrics for Prometheus
+metricsSocket = None        # or a Unix socket path that serves them, both None switch the metrics off
+eventSocket = None          # e.g. '/run/ShutdownRebootVolumeControl.events' to publish the events for other processes
+
+
+# set up the encoder and the button, a backend can be passed in, e.g. a SimulatedBackend
+def init(backend=None):
+    GpioDaemon.GPIObackend = GPIObackend
+    GpioDaemon.capture = capture
+    GpioDaemon.captureFile = captureFile
+    GpioDaemon.metricsFile = metricsFile
+    GpioDaemon.metricsSocket = metricsSocket
+    GpioDaemon.eventSocket = eventSocket
+    for hook in preShutdownHooks:
+        GpioDevices.power.addHook(hook)
+    volume = GpioDaemon.openMixer(mixerControl, mixerInterval)     # the mixer channel is opened on the first detent
+    GpioDaemon.addDevice(Encoder('volume', GPIOpinA, GPIOpinB, volumeAction(volume), resolution, acceleration), rotaryMinPulse)
+    GpioDaemon.addDevice(Button('power', GPIOpinButton, GpioDaemon.timers, hold=buttonActions), buttonMinPulse)
+    GpioDaemon.init(backend)
 
 
 # the main function
 def main():
-    try:                    # run the program
-        init()              # initialize everything
-        while True:         # idle loop
-            sleep(300)      # wakes up once every 5 minutes = 300 seconds
-    except KeyboardInterrupt:
-        GPIO.cleanup()      # clean up GPIO on CTRL+C exit
-    GPIO.cleanup()          # clean up GPIO on normal exit
+    init()                  # initialize everything
+    GpioDaemon.serve()      # tell systemd we are ready, dispatch the GPIO events until CTRL+C or SIGTERM
 
 # the entry point
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
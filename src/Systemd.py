@@ -0,0 +1,63 @@
+#!/usr/bin/env python3.5
+
+# This Python module lets the scripts run as systemd services of Type=notify (see GpioDaemon.service).
+# ready() tells systemd that edge detection is armed, so units ordered after the service start only then, and
+# systemctl start returns only then. If the unit has WatchdogSec, the main loop of the GPIO backend pings the watchdog
+# at half of that interval, so systemd restarts the script when the loop hangs. A health check can be passed that
+# must hold for each ping, e.g. that the decoder thread is still alive. SIGTERM (systemctl stop) lets the main loop
+# return, so the scripts shut down cleanly and write the last volume change.
+# The messages are datagrams to the socket in $NOTIFY_SOCKET, the sd_notify() protocol, no libsystemd is needed.
+# Without systemd, e.g. when started from rc.local or a terminal, all of this does nothing.
+# Usage:
+# init()                            # arm edge detection
+# Systemd.ready(gpio)               # READY=1 and watchdog pings from gpio.run()
+# gpio.run()
+# Systemd.notify('STOPPING=1')
+
+import os
+import signal
+
+
+_socket = None      # the datagram socket to systemd, opened on the first notify()
+
+
+# send states to systemd, e.g. 'READY=1', returns False if not started by systemd
+def notify(*states):
+    global _socket
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address[0] == '@':                                   # a socket in the abstract namespace
+        address = '\0' + address[1:]
+    if _socket is None:
+        import socket
+        _socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+    try:
+        _socket.sendto('\n'.join(states).encode(), address)
+    except OSError:
+        return False
+    return True
+
+
+# the watchdog interval in seconds that systemd expects pings in, or None if the unit has no WatchdogSec
+def watchdogInterval():
+    usec = os.environ.get('WATCHDOG_USEC')
+    pid = os.environ.get('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1e6
+
+
+# signal readiness, ping the watchdog from gpio.run() while healthy() holds, and stop gpio.run() on SIGTERM
+def ready(gpio, healthy=None, status=None):
+    signal.signal(signal.SIGTERM, lambda signum, frame: gpio.stop())
+    interval = watchdogInterval()
+    if interval:
+        def ping():
+            if healthy is None or healthy():
+                notify('WATCHDOG=1')
+        gpio.tick(ping, interval / 2)
+    states = ['READY=1', 'MAINPID=%d' % os.getpid()]
+    if status:
+        states.append('STATUS=' + status)
+    return notify(*states)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3.5
+
+# This Python module runs timers for any number of buttons and glitch filters in a single thread.
+# The timers are kept in a hashed timer wheel: a ring of slots, one per tick (default 10 ms). schedule() appends the
+# timer to the slot of its deadline and cancel() only marks it, both take constant time, no matter how many timers are
+# running. The thread wakes up once per tick while timers are running and not at all when there are none. Timers that
+# are more than one revolution ahead stay in their slot until their deadline has come.
+# The deadlines are in nanoseconds of the monotonic clock (the timestamps of the GPIO backends), so a timer can be set
+# relative to the edge that started it. The callbacks run in the timer thread with lock held, so a device can take
+# lock to change its state and timers atomically. Without the thread, e.g. when replaying a trace, advance(timestamp)
+# fires the timers that are due by timestamp. In a callback, now is the deadline of the timer.
+# Usage:
+# timers = TimerWheel(0.01)
+# timers.start()
+# timer = timers.schedule(timestamp + 2000000000, callback, arguments)  # callback(arguments) 2 s after timestamp
+# timers.cancel(timer)
+
+from threading import Event, RLock, Thread
+from time import monotonic_ns
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'args', 'active')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline    # in ns
+        self.callback = callback
+        self.args = args
+        self.active = True          # False when fired or cancelled
+
+
+class TimerWheel:
+    __slots__ = ('tick', 'slots', 'now', 'lock', 'count', 'fired', 'closed', '_tick', '_mask', '_wheel', '_current',
+                 '_due', '_wakeup', '_thread')
+
+    def __init__(self, tick=0.01, slots=256):
+        if slots & (slots - 1):
+            raise ValueError('slots must be a power of 2')
+        self.tick = tick                        # resolution in seconds, timers fire up to one tick late
+        self.slots = slots                      # number of slots, one revolution is slots * tick
+        self.now = monotonic_ns()               # the time of the timer that is fired
+        self.lock = RLock()                     # held while the timers are changed and the callbacks run
+        self.count = 0                          # number of running timers
+        self.fired = 0                          # number of timers fired so far, for statistics
+        self.closed = False
+        self._tick = int(tick * 1e9)            # the same in nanoseconds
+        self._mask = slots - 1
+        self._wheel = [[] for slot in range(slots)]
+        self._current = self.now // self._tick  # the tick up to which the slots have been visited
+        self._due = []                          # timers scheduled at a deadline that has already passed
+        self._wakeup = Event()                  # wakes the timer thread when the first timer is scheduled
+        self._thread = None                     # the timer thread, if started with start()
+
+    # call callback(*args) at deadline (in ns of the monotonic clock), returns the timer, e.g. to cancel it
+    def schedule(self, deadline, callback, *args):
+        timer = Timer(deadline, callback, args)
+        with self.lock:
+            tick = deadline // self._tick
+            if tick <= self._current:
+                self._due.append(timer)
+            else:
+                self._wheel[tick & self._mask].append(timer)
+            self.count += 1
+            if self.count == 1 and not self._wakeup.is_set():
+                self._wakeup.set()              # the timer thread has been sleeping without timers
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer.active:
+                timer.active = False
+                self.count -= 1
+
+    # fire the timers that are due by timestamp (in ns), in the order of their deadlines
+    def advance(self, timestamp):
+        with self.lock:
+            while True:
+                due, self._due = self._due, []
+                target = timestamp // self._tick
+                if target > self._current:
+                    wheel = self._wheel
+                    for tick in range(self._current + 1, self._current + 1 + min(target - self._current, self.slots)):
+                        slot = wheel[tick & self._mask]
+                        if slot:
+                            keep = []
+                            for timer in slot:
+                                if timer.deadline <= timestamp:
+                                    due.append(timer)
+                                elif timer.active:
+                                    keep.append(timer)      # a later revolution, or later in the current tick
+                            wheel[tick & self._mask] = keep
+                    self._current = target - 1  # visit the current tick again, its later timers are not due yet
+                if not due:
+                    return
+                due.sort(key=lambda timer: timer.deadline)
+                for timer in due:
+                    if timer.active:            # it may have been cancelled by an earlier callback
+                        timer.active = False
+                        self.count -= 1
+                        self.fired += 1
+                        self.now = timer.deadline
+                        timer.callback(*timer.args)
+                # the callbacks may have scheduled timers that are due already, fire them, too
+
+    # start the timer thread
+    def start(self):
+        self._thread = Thread(target=self._run, name='TimerWheel', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    # stop the timer thread, running timers do not fire anymore
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    # the timer thread
+    def _run(self):
+        while not self.closed:
+            self._wakeup.clear()                # schedule() sets it again if a timer comes in meanwhile
+            if not self.count:
+                self._wakeup.wait()             # sleep until a timer is scheduled or close()
+                continue
+            now = monotonic_ns()
+            self._wakeup.wait(((now // self._tick + 1) * self._tick - now) / 1e9)  # sleep until the next tick
+            self.advance(monotonic_ns())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3.5
+
+# This Python script analyzes edge traces offline to tune the glitch filter of the scripts in this directory.
+# It loads a trace (captured by EdgeCapture.py with kill -USR1 PID, or a text trace of GpioSimulator.py) as NumPy arrays
+# and computes, per pin and without Python loops over the edges, so traces with millions of edges take a second:
+# - the histogram of the pulse widths, i.e. the times between two edges of a pin, on a logarithmic scale,
+# - the bounce bursts, i.e. runs of edges less than minPulse apart, their number of edges and duration,
+# - the minimum stable time, i.e. the shortest pulse of all and the shortest pulse that is longer than minPulse.
+# The pulse widths of real pins fall into two groups, the short ones of bounce and glitches and the long ones of
+# actual presses and turns. The recommended minPulse for GlitchFilter.py lies in the gap between them (their geometric
+# mean). It is validated by replaying the trace through GlitchFilter and checking the remaining pulses.
+# This script requires NumPy: sudo apt-get install python3-numpy. It does not need a Pi.
+# python TraceAnalyzer.py /tmp/ShutdownRebootButton.trace          # analyze and recommend minPulse
+# python TraceAnalyzer.py /tmp/RotaryEncoder.trace 0.05            # validate minPulse = 0.05 ms instead
+
+import sys
+import numpy
+from EdgeCapture import isTraceFile, loadTraceArray
+from GlitchFilter import GlitchFilter
+
+
+TRACE_DTYPE = numpy.dtype([('timestamp', '<u8'), ('pin', '<u2'), ('level', 'u1')])
+BINS = numpy.logspace(2, 11, 37)    # pulse width histogram bins, 4 per decade from 100 ns to 100 s
+SEPARATION = 4.0                    # the short and long pulses must be at least this factor apart to recommend a filter
+MAX_GLITCH = 20000000               # bounce and glitches are shorter than 20 ms, longer pulses are always taken for real
+
+
+# load a trace file, binary or text, as a structured array with the fields timestamp, pin and level
+def loadTrace(path):
+    if isTraceFile(path):
+        return loadTraceArray(path)
+    return numpy.loadtxt(path, dtype=TRACE_DTYPE, ndmin=1)
+
+
+# make a structured array from a trace given as a list of edges (timestamp, pin, level)
+def traceArray(trace):
+    return numpy.array([tuple(edge) for edge in trace], dtype=TRACE_DTYPE)
+
+
+# split a trace into the pins, returns {pin: (timestamps, levels)}, both sorted by timestamp
+def pinEdges(edges):
+    order = numpy.lexsort((edges['timestamp'], edges['pin']))
+    pins = edges['pin'][order]
+    timestamps = edges['timestamp'][order].astype(numpy.int64)
+    levels = edges['level'][order]
+    starts = numpy.flatnonzero(numpy.diff(pins)) + 1
+    return {int(pin): (t, l) for pin, t, l in zip(pins[numpy.r_[0, starts]] if len(pins) else (),
+                                                   numpy.split(timestamps, starts), numpy.split(levels, starts))}
+
+
+# the widths of the pulses of one pin in ns
+def pulseWidths(timestamps):
+    return numpy.diff(timestamps)
+
+
+# the width in the middle of the gap between short and long pulses, or 0 if there is no clear gap
+# the gap must be at least SEPARATION wide and the short pulses at most maxGlitch ns long. If there are several such
+# gaps, the one that splits the logarithmic widths into the most distinct groups is taken (Otsu's method).
+def recommendMinPulse(widths, maxGlitch=MAX_GLITCH):
+    widths = numpy.sort(widths[widths > 0])
+    if len(widths) < 2:
+        return 0
+    candidates = numpy.flatnonzero((widths[1:] >= widths[:-1] * SEPARATION) & (widths[:-1] <= maxGlitch))
+    if not len(candidates):
+        return 0
+    logs = numpy.log10(widths)
+    sums = numpy.cumsum(logs)
+    short = candidates + 1.0                                # number of short pulses below each candidate gap
+    long = len(logs) - short
+    separation = short * long * (sums[candidates] / short - (sums[-1] - sums[candidates]) / long) ** 2
+    gap = candidates[numpy.argmax(separation)]
+    return int(numpy.sqrt(float(widths[gap]) * float(widths[gap + 1])))
+
+
+# the bursts of edges less than minPulse ns apart, returns the number of edges and the duration in ns of each burst
+def bursts(timestamps, minPulse):
+    if not len(timestamps):
+        return numpy.zeros(0, numpy.int64), numpy.zeros(0, numpy.int64)
+    starts = numpy.r_[0, numpy.flatnonzero(numpy.diff(timestamps) >= minPulse) + 1]
+    ends = numpy.r_[starts[1:], len(timestamps)] - 1
+    sizes = ends - starts + 1
+    durations = timestamps[ends] - timestamps[starts]
+    burst = sizes > 1                           # single edges are clean level changes
+    return sizes[burst], durations[burst]
+
+
+# analyze the edges of each pin, returns {pin: statistics} with minPulse in ns (recommended, if not given)
+def analyze(edges, minPulse=None):
+    results = {}
+    for pin, (timestamps, levels) in pinEdges(edges).items():
+        widths = pulseWidths(timestamps)
+        recommended = recommendMinPulse(widths)
+        threshold = recommended if minPulse is None else minPulse
+        sizes, durations = bursts(timestamps, threshold) if threshold else bursts(timestamps[:0], 1)
+        long = widths[widths >= threshold]
+        results[pin] = {
+            'edges': len(timestamps),
+            'histogram': numpy.histogram(widths, BINS)[0],
+            'minStable': int(widths.min()) if len(widths) else None,
+            'minStableLong': int(long.min()) if len(long) else None,
+            'bursts': len(sizes),
+            'burstEdges': int(sizes.sum()),
+            'burstMaxEdges': int(sizes.max()) if len(sizes) else 0,
+            'burstDurations': numpy.percentile(durations, (50, 99, 100)).astype(numpy.int64) if len(durations) else None,
+            'recommended': recommended}
+    return results
+
+
+# one minPulse for a group of pins (e.g. the two channels of an encoder), the smallest of their recommendations
+def recommendForPins(results, pins=None):
+    recommended = [result['recommended'] for pin, result in results.items() if pins is None or pin in pins]
+    recommended = [minPulse for minPulse in recommended if minPulse]
+    return min(recommended) if recommended else 0
+
+
+# replay the edges through GlitchFilter with minPulse ns, returns the filtered edges as a structured array
+def filterTrace(edges, minPulse):
+    edges = edges[numpy.argsort(edges['timestamp'], kind='stable')]
+    glitchFilter = GlitchFilter(minPulse / 1e9)
+    filtered = []
+    callback = glitchFilter.wrap(lambda pin, level, timestamp: filtered.append((timestamp, pin, level)))
+    for timestamp, pin, level in zip(edges['timestamp'].tolist(), edges['pin'].tolist(), edges['level'].tolist()):
+        callback(pin, level, timestamp)
+    glitchFilter.close()
+    return numpy.array(filtered, dtype=TRACE_DTYPE)
+
+
+# validate minPulse ns on a trace, returns {pin: (edges before, edges after, shortest pulse after filtering)}
+def validate(edges, minPulse):
+    before = pinEdges(edges)
+    after = pinEdges(filterTrace(edges, minPulse))
+    results = {}
+    for pin, (timestamps, levels) in before.items():
+        filteredTimestamps = after.get(pin, (timestamps[:0], levels[:0]))[0]
+        widths = pulseWidths(filteredTimestamps)
+        results[pin] = (len(timestamps), len(filteredTimestamps), int(widths.min()) if len(widths) else None)
+    return results
+
+
+# format a time in ns
+def formatTime(ns):
+    if ns is None:
+        return '-'
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if ns >= scale:
+            return '%.3g %s' % (ns / scale, unit)
+    return '%d ns' % ns
+
+
+# print the analysis, the recommendation and its validation
+def report(edges, minPulse=None):
+    results = analyze(edges, minPulse)
+    for pin, result in sorted(results.items()):
+        print('pin %d: %d edges, shortest pulse %s, shortest pulse above minPulse %s'
+              % (pin, result['edges'], formatTime(result['minStable']), formatTime(result['minStableLong'])))
+        histogram = result['histogram']
+        scale = max(1, histogram.max()) / 50
+        for count, low, high in zip(histogram, BINS[:-1], BINS[1:]):
+            if count:
+                print('  %9s - %-9s %8d %s' % (formatTime(low), formatTime(high), count, '#' * max(1, int(count / scale))))
+        if result['bursts']:
+            p50, p99, pmax = result['burstDurations']
+            print('  %d bounce bursts with %d edges (up to %d), duration p50 %s  p99 %s  max %s'
+                  % (result['bursts'], result['burstEdges'], result['burstMaxEdges'], formatTime(p50), formatTime(p99),
+                     formatTime(pmax)))
+        print('  recommended minPulse %s' % (formatTime(result['recommended']) if result['recommended'] else '0 (no clear gap)'))
+
+    if minPulse is None:
+        minPulse = recommendForPins(results)
+    print('validation of minPulse %s (%.3g ms) with GlitchFilter:' % (formatTime(minPulse), minPulse / 1e6))
+    for pin, (before, after, shortest) in sorted(validate(edges, minPulse).items()):
+        print('  pin %d: %d -> %d edges, shortest remaining pulse %s%s'
+              % (pin, before, after, formatTime(shortest),
+                 '  TOO SHORT' if shortest is not None and shortest < minPulse else ''))
+
+
+# the entry point
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python TraceAnalyzer.py TRACEFILE [minPulse in ms]')
+        sys.exit(1)
+    report(loadTrace(sys.argv[1]), int(float(sys.argv[2]) * 1e6) if len(sys.argv) > 2 else None)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3.5
+
+# This Python module keeps one ALSA mixer open and coalesces volume changes.
+# change() only adds the detents to a pending value and returns immediately. A writer thread applies the pending change
+# to a shadow copy of the volume and writes it to the mixer at most once per interval (default 5 ms). Volume changes
+# made by other programs (e.g. alsamixer) are picked up through the mixer's poll descriptors, so the volume does not have
+# to be read back on every detent.
+# Any object with the methods getvolume() and setvolume() can be passed as mixer, e.g. a fake one for testing without
+# sound hardware. If it also has polldescriptors() and handleevents(), external changes are tracked as well.
+# This module requires the python-alsaaudio package when no mixer is passed in: sudo apt-get install python-alsaaudio.
+# It is imported and the ALSA mixer is opened by the writer thread on the first change(), not before, so a script is
+# ready to read the encoder early during boot, and loading ALSA does not delay it.
+# Usage:
+# volume = VolumeMixer('Master')
+# volume.change(+1)     # e.g. for every detent
+# volume.close()
+
+import os
+import select
+from threading import Lock, Thread
+from time import monotonic, perf_counter, sleep
+
+
+class VolumeMixer:
+    __slots__ = ('control', 'mixer', 'interval', 'volume', 'pending', 'writes', 'externalChanges', 'latency',
+                 '_lastWrite', '_lock', '_closed', '_wakeup', '_thread')
+
+    def __init__(self, control='Master', interval=0.005, mixer=None):
+        self.control = control                      # the ALSA mixer channel, e.g. 'Digital' for IQaudIO's Pi-DAC+ card
+        self.mixer = mixer                          # None until the ALSA mixer is opened on the first change
+        self.interval = interval                    # minimum time in seconds between two mixer writes
+        self.volume = None if mixer is None else int(mixer.getvolume()[0])  # shadow of the left channel's volume gain (right channel is the same)
+        self.pending = 0                            # volume change not yet written to the mixer
+        self.writes = 0                             # number of mixer writes, for statistics
+        self.externalChanges = 0                    # number of volume changes by other programs that have been picked up
+        self.latency = None                         # a Metrics.Histogram of the mixer write durations, or None
+        self._lastWrite = 0.0                       # time of the last mixer write
+        self._lock = Lock()                         # guards pending and _closed
+        self._closed = False
+        self._wakeup = os.pipe()                    # change() and close() wake the writer thread via this pipe
+        self._thread = Thread(target=self._run, name='VolumeMixer', daemon=True)
+        self._thread.start()
+
+    # in-/decrease the volume by delta, this never blocks on the mixer, after close() it does nothing
+    def change(self, delta):
+        with self._lock:
+            if self._closed:                        # e.g. a late edge passed on by a glitch filter during shutdown
+                return
+            wakeup = not self.pending               # if something is pending, the writer thread is already awake
+            self.pending += delta
+            if wakeup:                              # under the lock, so close() cannot close the pipe meanwhile
+                os.write(self._wakeup[1], b'\0')
+
+    # write the pending change and stop the writer thread
+    def close(self):
+        with self._lock:
+            self._closed = True
+            os.write(self._wakeup[1], b'\0')
+        self._thread.join()
+        os.close(self._wakeup[0])
+        os.close(self._wakeup[1])
+
+    # the writer thread
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._wakeup[0], select.POLLIN)
+        mixerFds = set()
+        if self.mixer is not None:
+            self._track(poller, mixerFds)
+
+        while True:
+            for fd, event in poller.poll():
+                if fd in mixerFds:                  # the mixer changed, by us or by another program
+                    self.mixer.handleevents()
+                    self._update()
+                else:                               # change() or close() woke us
+                    os.read(fd, 4096)
+                    if self.mixer is None and self.pending:
+                        self._open()                # the first detent
+                        self._track(poller, mixerFds)
+                    self._write()
+            if self._closed:
+                self._write()
+                return
+
+    # open the ALSA mixer channel
+    def _open(self):
+        import alsaaudio
+        self.mixer = alsaaudio.Mixer(self.control)
+        self.volume = int(self.mixer.getvolume()[0])
+
+    # track external volume changes through the poll descriptors of the mixer
+    def _track(self, poller, mixerFds):
+        if hasattr(self.mixer, 'polldescriptors'):
+            for fd, eventmask in self.mixer.polldescriptors():
+                poller.register(fd, eventmask)
+                mixerFds.add(fd)
+
+    # write the pending change to the mixer, but not earlier than interval after the last write
+    def _write(self):
+        if self.mixer is None:                      # not opened yet, so nothing has changed
+            return
+        delay = self._lastWrite + self.interval - monotonic()
+        if delay > 0:
+            sleep(delay)                            # meanwhile further detents add up in pending
+        with self._lock:
+            delta = self.pending
+            self.pending = 0
+        volume = min(100, max(0, self.volume + delta))  # stay within 0 and 100 (ALSA min and max)
+        if volume == self.volume:
+            return
+        start = perf_counter()
+        self.mixer.setvolume(volume)                # apply the new volume gain to the mixer channel
+        # To control the different subchannels of the mixer channel independently, replace the line above by these (example for stereo)
+        # self.mixer.setvolume(volume, 0)           # apply the new volume gain to the left line of the mixer channel
+        # self.mixer.setvolume(volume, 1)           # apply the new volume gain to the right line of the mixer channel
+        if self.latency is not None:
+            self.latency.observe(perf_counter() - start)
+        self.volume = volume
+        self.writes += 1
+        self._lastWrite = monotonic()
+
+    # read the volume after a mixer event, this is our own write or an external change
+    def _update(self):
+        volume = int(self.mixer.getvolume()[0])
+        if volume != self.volume:
+            self.volume = volume
+            self.externalChanges += 1
@@ -3,9 +3,26 @@
 # This Python script reads a rotary encoder connected to GPIO pin 16 and 18, GND on pin 14 or any other ground pin,
 # and controls the ALSA Master volume.
 # Some encoders have inverse direction; in this case swap the values of GPIOpinA and GPIOpinB accordingly.
-# This solution works without debouncing. However, very quick rotation may lead to missing state changes and, hence,
-# some results could be wrong.
-# Put it to a location on your Pi, say /home/pi/myTools/ and add the following line to /etc/rc.local before exit 0.
+# The encoder is an Encoder of GpioDevices.py (put it into the same directory with the modules it requires), as in
+# GpioDaemon.py. Its channel states are decoded by QuadratureDecoder.py, which bridges state changes that get missed on
+# very quick rotation instead of losing the detent.
+# The pins are read via GpioBackend.py (also in the same directory), either with RPi.GPIO or with the Linux GPIO
+# character device. With RPi.GPIO, the interrupts only enqueue the edges (see EdgeQueue.py, also in the same
+# directory), a single decoder thread processes them in order. With the character device, they are decoded directly in
+# its event loop. The gpiomem backend samples both channels at once, at a fixed rate, for encoders that outrun the
+# interrupts. The detents are passed on to VolumeMixer.py (also in the same directory). It keeps
+# the mixer open and writes it at most once per mixerInterval. On fast rotation, RotaryAcceleration.py (also in the
+# same directory) makes the volume steps bigger, slow rotation keeps 1 % steps.
+# The last edges are kept by EdgeCapture.py (also in the same directory), kill -USR1 PID writes them to captureFile.
+# Bounce and glitches are removed by GlitchFilter.py (also in the same directory) before decoding. TraceAnalyzer.py
+# recommends its minPulse from a captured trace. A level is passed on when the next edge comes or, if none comes, when
+# it is due: with gpiochip and gpiomem their loop checks that, with RPi.GPIO the decoder thread does when the edge queue
+# is empty. So the decoding stays in one thread, and no level is passed on while an edge that reverses it still waits.
+# With metricsFile or metricsSocket set, Metrics.py (also in the same directory) times the edges and the mixer writes and
+# counts decoder errors, for Prometheus. Without, the metrics are off and cost nothing.
+# Put it to a location on your Pi, say /home/pi/myTools/ and install it as systemd service like GpioDaemon.service,
+# Systemd.py (also in the same directory) tells systemd when edge detection is armed and pings its watchdog. Or add the
+# following line to /etc/rc.local before exit 0.
 # python /home/pi/myTools/VolumeRotaryControl.py&
 # After the next reboot the script will run in background.
 # This script requires the python-alsaaudio package to be installed: sudo apt-get install python-alsaaudio.
@@ -20,101 +37,100 @@
 #  B  |       |       |       |
 #   --+       +-------+       +------ 1
 
-from RPi import GPIO
-from time import sleep
-import alsaaudio
+from GpioBackend import openBackend
+from EdgeCapture import EdgeCapture
+from VolumeMixer import VolumeMixer
+from GpioDevices import Encoder, volumeAction
+from QuadratureDecoder import FULL_STEP
+from RotaryAcceleration import RotaryAcceleration
+from EdgeQueue import EdgeQueue
+from GlitchFilter import GlitchFilter
+import Systemd
 
 
+GPIObackend = 'RPi.GPIO'    # set 'gpiochip' to read the pins via the Linux GPIO character device (one thread, kernel timestamps), or 'gpiomem' to sample both at once
 GPIOpinA = 23   # left pin of the rotary encoder is on GPIO 23 (Pi pin 16)
 GPIOpinB = 24   # right pin of the rotary encoder is on GPIO 24 (Pi pin 18)
-lock = False    # this is set True to prevent interference of multiple interrupt processings
-aDown = False   # this is set True to wait for GPIO A to go down
-bUp = False     # this is set True to wait for GPIO B to go up
-bDown = False   # this is set True to wait for GPIO B to go down
-
-
-# initialize GPIO input and define interrupts
-def init():
-    GPIO.setmode(GPIO.BCM)                                                  # set the GPIO naming/numbering convention to BCM
-    GPIO.setup(GPIOpinA, GPIO.IN, pull_up_down=GPIO.PUD_UP)                 # input channel A
-    GPIO.setup(GPIOpinB, GPIO.IN, pull_up_down=GPIO.PUD_UP)                 # input channel B
-    GPIO.add_event_detect(GPIOpinA, GPIO.BOTH, callback=rotaryInterruptA)   # define interrupt for action on channel A (no bouncetime needed)
-    GPIO.add_event_detect(GPIOpinB, GPIO.BOTH, callback=rotaryInterruptB)   # define interrupt for action on channel B (no bouncetime needed)
-
-
-# the callback functions when turning the encoder
-# this one reacts on action on channel A
-def rotaryInterruptA(GPIOpin):
-    global lock, GPIOpinA, GPIOpinB         # get access to some global variables
-    A = GPIO.input(GPIOpinA)                # read current value of channel A
-    B = GPIO.input(GPIOpinB)                # read current value of channel B
-
-    while lock:                             # while another interrupt is processing
-        pass                                # wait
-
-    lock = True                             # now, prevent other interrupts to interfere
-
-    global value, aDown, bUp, bDown         # get access to some more global variables
-    if aDown:                               # if we are waiting for channel A to go down (to finish -> rotation cycle)
-        if not A:                           # check if it is down now
-            aDown = False                   # -> rotation cycle finished
-    elif bUp or bDown:                      # if a <- rotation cycle is unfinished so far
-        pass                                # don't do anything new
-    elif A:                                 # if a new rotation cycle starts, i.e. nothing to go up or down
-        mixer = alsaaudio.Mixer()           # get ALSA mixer channel 'Master'
-        # To control a different mixer channel, e.g. the 'Digital' channel from IQaudIO's Pi-DAC+ card, edit the above line in the following way
-        # mixer = alsaaudio.Mixer('Digital')
-        volume = int(mixer.getvolume()[0])  # get the left channel's volume gain (right channel is the same)
-
-        if B:                               # if B is already up, the rotation direction is ->
-            aDown = True                    # to finish the cycle, wait for A to go down again
-            if volume < 100:                # do not get greater than 100 (ALSA max)
-                volume += 1                 # increase volume gain
-        else:                               # if B still has to come up, the rotation direction is <-
-            bUp = True                      # in this rotation cycle B has to come up and down again, we start with waiting for B to come up
-            if volume > 0:                  # do not get below 0 (ALSA min)
-                volume -= 1                 # decrease volume gain
-
-        mixer.setvolume(volume)             # apply the new volume gain to the mixer channel
-        # To control the different subchannels of the mixer channel independently, replace the line above by these (example for stereo)
-        # mixer.setvolume(volume, 0)          # apply the new volume gain to the left line of the mixer channel
-        # mixer.setvolume(volume, 1)          # apply the new volume gain to the right line of the mixer channel
-
-    lock = False                            # unlock, now other interrupts can do their job
-    return                                  # done
-
-
-# this callback function reacts on action on channel B
-def rotaryInterruptB(GPIOpin):
-    global lock, GPIOpinB           # get access to some global variables
-    B = GPIO.input(GPIOpinB)        # read current value of channel B
-
-    while lock:                     # while another interrupt is processing
-        pass                        # wait
-
-    lock = True                     # now, prevent other interrupts to interfere
-
-    global bUp, bDown               # get access to some more global variables
-    if B:                           # if B is up
-        if bUp:                     # and we have been waiting for B to come up (this is part of the <- rotation cycle)
-            bDown = True            # wait for B to come down again
-            bUp = False             # done with this
-    elif bDown:                     # B is down (if B: was False) and if we were waiting for B to come down
-        bDown = False               # <- rotation cycle finished
-
-    lock = False                    # unlock, now other interrupts can do their job
-    return                          # done
+edges = EdgeQueue(256)  # the interrupts put the edges in here, the decoder thread takes them out in order
+glitchFilter = GlitchFilter(0.00002)   # passes a channel level on only after it was stable for 20 us, set None to switch the filter off
+resolution = FULL_STEP  # use HALF_STEP or QUARTER_STEP if your encoder has more detents per cycle
+mixerControl = 'Master'     # the ALSA mixer channel, e.g. 'Digital' for the IQaudIO Pi-DAC+ card
+mixerInterval = 0.005       # write the mixer at most once every 5 ms, detents in between are added up
+acceleration = RotaryAcceleration(window=4, slowRate=10, exponent=2, cap=20)   # bigger volume steps on fast rotation, set None for fixed 1 % steps
+volume = None               # the VolumeMixer, it is opened in init()
+encoder = None              # the Encoder, it is set up in init()
+capture = EdgeCapture(65536)    # keeps the last 65536 edges for analysis, set None to switch the capture off
+captureFile = '/tmp/VolumeRotaryControl.trace'  # kill -USR1 PID writes the captured edges to this file
+metricsFile = None          # e.g. '/var/lib/node_exporter/textfile_collector/VolumeRotaryControl.prom' to export metrics for Prometheus
+metricsSocket = None        # or a Unix socket path that serves them, both None switch the metrics off
+metrics = None              # the Metrics, if switched on, set up in init()
+gpio = None                 # the GPIO backend, it is opened in init()
+
+
+# initialize GPIO input and define interrupts, a backend can be passed in, e.g. a SimulatedBackend
+def init(backend=None):
+    global volume, gpio, metrics, encoder                       # get access to some global variables
+    volume = VolumeMixer(mixerControl, mixerInterval)           # the mixer channel is opened on the first detent
+    gpio = backend or openBackend(GPIObackend)                  # open the GPIO backend
+    encoder = Encoder('volume', GPIOpinA, GPIOpinB, volumeAction(volume), resolution, acceleration)
+    if gpio.snapshots:                                          # read both channels of the same sample (gpiomem)
+        encoder.input = gpio.input
+    decode = encoder.edge
+    if glitchFilter:                                            # remove bounce and glitches before decoding
+        decode = glitchFilter.wrap(decode)
+    if metricsFile or metricsSocket:                            # time the edges, the mixer writes and count the errors
+        from Metrics import Metrics
+        metrics = Metrics()
+        decode = metrics.wrapEdges(decode)
+        volume.latency = metrics.histogram('mixer_write_seconds', 'Durations of the mixer writes.', control=mixerControl)
+        metrics.collect('gpio_edges_dropped_total', 'Edges pushed out of the full edge queue.', lambda: edges.dropped)
+        metrics.collect('encoder_invalid_total', 'Invalid channel transitions.', lambda: encoder.decoder.invalid)
+        metrics.collect('encoder_position', 'Detents turned since the start.', lambda: encoder.decoder.position, 'gauge')
+        metrics.start(metricsFile, metricsSocket)
+    if gpio.threadedCallbacks:                                  # RPi.GPIO calls back from its own thread
+        callback = rotaryInterrupt                              # so only enqueue there
+        edges.start(decode)                                     # and decode in the decoder thread
+    else:                                                       # the gpiochip event loop runs in the main thread
+        callback = decode                                       # so it can decode right away
+    if capture:                                                 # record every edge before it is processed
+        callback = capture.wrap(callback)
+        capture.dumpOnSignal(captureFile)
+    gpio.watch(GPIOpinA, callback)                              # input channel A, react on both edges (bounce is removed by glitchFilter)
+    gpio.watch(GPIOpinB, callback)                              # input channel B, react on both edges (bounce is removed by glitchFilter)
+    gpio.start()                                                # start edge detection
+    A = gpio.input(GPIOpinA)                                    # read the current channel states
+    B = gpio.input(GPIOpinB)
+    encoder.reset(A, B)                                         # start decoding from the current channel states
+    if glitchFilter:
+        glitchFilter.levels.update({GPIOpinA: A, GPIOpinB: B})  # the filter starts from them, too
+        if gpio.threadedCallbacks:
+            edges.addFilter(glitchFilter)                       # flush it from the decoder thread when the queue is empty
+        else:
+            gpio.addFilter(glitchFilter)                        # flush it from the event loop
+
+
+# the callback function when turning the encoder, it reacts on action on both channels
+# it only enqueues the edge and leaves the decoding and mixer access to the decoder thread, so it never waits for another interrupt
+def rotaryInterrupt(GPIOpin, level, timestamp):
+    edges.put((GPIOpin, level, timestamp))
 
 
 # the main function
 def main():
     try:                        # run the program
         init()                  # initialize everything
-        while True:             # idle loop
-            sleep(300)          # wakes up once every 5 minutes = 300 seconds
-    except KeyboardInterrupt:
-        GPIO.cleanup()          # clean up GPIO on CTRL+C exit
-    GPIO.cleanup()              # clean up GPIO on normal exit
+        Systemd.ready(gpio)     # edge detection is armed, tell systemd if it started us
+        gpio.run()              # dispatch the GPIO events (gpiochip) or idle (RPi.GPIO), ping the systemd watchdog
+    except KeyboardInterrupt:   # CTRL+C exit
+        pass
+    Systemd.notify('STOPPING=1')
+    gpio.cleanup()              # clean up GPIO
+    edges.close()               # let the decoder thread finish
+    if glitchFilter:
+        glitchFilter.close()    # pass on the last filtered edges
+    volume.close()              # write the last volume change
+    if metrics:
+        metrics.close()         # write the metrics file a last time
 
 # the entry point
 if __name__ == '__main__':